@@ -4,146 +4,2705 @@ import re
 import argparse
 import signal
 import os
+import struct
+import time
+import io
+import gzip
+import json
+import threading
+import socket
+import shlex
+import asyncio
+import concurrent.futures
+import selectors
+import resource
+import fcntl
+import sqlite3
+from array import array
 
-def set_ctm(device_id, multiplier):
+# For the startup time reported by --apply
+STARTED = time.perf_counter()
+
+CTM_PROP = 'Coordinate Transformation Matrix'
+PROFILE_PROP = 'libinput Accel Profile Enabled'
+SCROLL_PROP = 'libinput Scrolling Pixel Distance'
+CUSTOM_POINTS_PROP = 'libinput Accel Custom Motion Points'
+CUSTOM_STEP_PROP = 'libinput Accel Custom Motion Step'
+CONFIG_PATH = os.path.expanduser("~/.config/popos_multitouch_tuner/config.json")
+
+def ctm_values(multiplier):
+    return [multiplier, 0, 0, 0, multiplier, 0, 0, 0, 1]
+
+def profile_values(profile_type):
+    # profile_type: 'adaptive', 'flat' or 'custom' (libinput 1.23+)
+    if profile_type == 'custom':
+        return [0, 0, 1]
+    return [1, 0] if profile_type == 'adaptive' else [0, 1]
+
+def transition_props(multiplier, profile_type):
+    return [(CTM_PROP, ctm_values(multiplier)), (PROFILE_PROP, profile_values(profile_type))]
+
+# libinput accepts at most 64 custom motion points
+CUSTOM_POINTS_MAX = 64
+DEFAULT_CURVE = {'gain': 1.0, 'threshold': 1.0, 'accel': 1.0, 'points': 32, 'max_speed': 10.0}
+
+def custom_accel_points(curve):
+    # Output speed at input speeds 0, step, 2*step ... max_speed (device
+    # units/ms). The slope is `gain` up to `threshold`, then rises
+    # linearly to gain + accel at max_speed.
+    count = min(max(int(curve['points']), 2), CUSTOM_POINTS_MAX)
+    max_speed = float(curve['max_speed'])
+    gain, threshold, accel = float(curve['gain']), float(curve['threshold']), float(curve['accel'])
+    step = max_speed / (count - 1)
+    span = max(max_speed - threshold, 1e-6)
     try:
-        subprocess.run(
-            ['xinput', 'set-prop', str(device_id), 'Coordinate Transformation Matrix', 
-             str(multiplier), '0', '0', '0', str(multiplier), '0', '0', '0', '1'],
-            check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
-        )
-    except Exception as e:
-        print(f"Error setting CTM: {e}", file=sys.stderr)
+        import numpy as np
+    except ImportError:
+        np = None
+    if np is not None:
+        speed = np.arange(count) * step
+        over = np.maximum(speed - threshold, 0.0)
+        return step, np.round(gain * speed + accel * over * over / (2 * span), 4).tolist()
+    points = []
+    for i in range(count):
+        over = max(i * step - threshold, 0.0)
+        points.append(round(gain * i * step + accel * over * over / (2 * span), 4))
+    return step, points
+
+def custom_curve_props(curve):
+    # Step and points first so the profile switch picks up the new curve
+    step, points = custom_accel_points(curve)
+    return [(CUSTOM_STEP_PROP, [step]), (CUSTOM_POINTS_PROP, points), (PROFILE_PROP, profile_values('custom'))]
+
+class Histogram:
+    # Fixed-size latency histogram with power-of-two microsecond buckets
+    BUCKETS = 24  # 1us .. ~8s, last bucket is overflow
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        us = int(seconds * 1e6)
+        self.counts[min(us.bit_length(), self.BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, pct):
+        # Upper bound of the bucket holding the percentile, in microseconds
+        target = self.count * pct / 100.0
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if n and seen >= target:
+                return 1 << i
+        return 0
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'mean_us': round(self.total * 1e6 / self.count, 1) if self.count else 0,
+            'max_us': round(self.max * 1e6, 1),
+            'p50_us': self.percentile(50),
+            'p95_us': self.percentile(95),
+            'p99_us': self.percentile(99),
+            'buckets': self.counts,
+        }
+
+class DaemonStats:
+    def __init__(self):
+        self.started = time.time()
+        self.counters = {'lines': 0, 'events': 0, 'gestures': 0, 'transitions': 0,
+                         'writes': 0, 'writes_avoided': 0, 'reconfigures': 0,
+                         'restarts': 0, 'downtime_ms': 0, 'queue_depth': 0, 'queue_depth_max': 0,
+                         'transitions_collapsed': 0, 'subprocess_spawns': 0, 'errors': 0}
+        self.histograms = {}
+        # perf_counter of the last read that returned data
+        self.last_read = 0.0
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name, seconds):
+        hist = self.histograms.get(name)
+        if hist is None:
+            hist = self.histograms[name] = Histogram()
+        hist.add(seconds)
+
+    def snapshot(self):
+        return {
+            'pid': os.getpid(),
+            'updated': time.time(),
+            'uptime': round(time.time() - self.started, 1),
+            'counters': dict(self.counters),
+            'histograms': {name: hist.snapshot() for name, hist in list(self.histograms.items())},
+        }
+
+STATS = DaemonStats()
+
+def default_stats_path():
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR') or '/tmp'
+    return os.path.join(runtime_dir, 'popos_multitouch_tuner', 'daemon_stats.json')
 
-def set_profile(device_id, profile_type):
-    # profile_type: 'adaptive' or 'flat'
-    val = "1, 0" if profile_type == 'adaptive' else "0, 1"
+def write_stats_file(path):
+    # Write to a temp file and rename so readers never see a partial file
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(STATS.snapshot(), f)
+    os.replace(tmp_path, path)
+
+def start_stats_writer(path, interval, stop=None):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    stop = stop or threading.Event()
+
+    def loop():
+        while True:
+            try:
+                write_stats_file(path)
+            except Exception as e:
+                print(f"Error writing stats file: {e}", file=sys.stderr)
+            if stop.wait(interval):
+                return
+
+    threading.Thread(target=loop, daemon=True).start()
+
+def default_history_path():
+    data_dir = os.environ.get('XDG_DATA_HOME') or os.path.expanduser('~/.local/share')
+    return os.path.join(data_dir, 'popos_multitouch_tuner', 'history.sqlite')
+
+HISTORY_KINDS = ['swipe', 'pinch', 'hold']
+
+class GestureHistory:
+    # Completed gestures in a fixed-size ring of typed arrays, so memory
+    # stays the same over weeks of uptime. Durations come from the event
+    # timestamps (libinput or kernel), not from when we got to them.
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self.begun = array('d', bytes(8 * capacity))      # wall clock at begin
+        self.durations = array('f', bytes(4 * capacity))  # ms
+        self.kinds = array('B', bytes(capacity))
+        self.fingers = array('B', bytes(capacity))
+        self.total = 0
+        self.flushed = 0
+        self.dropped = 0
+        # kind -> (fingers, event time, wall clock) of the gesture in progress
+        self.open = {}
+        self.lock = threading.Lock()
+
+    def observe(self, phase, fingers, kind, stamp):
+        if phase == 'begin':
+            self.open[kind] = (fingers, stamp, time.time())
+            return
+        begin = self.open.pop(kind, None)
+        if begin:
+            self.record(kind, begin[0], begin[2], max(stamp - begin[1], 0.0) * 1000)
+
+    def record(self, kind, fingers, begun, duration_ms):
+        with self.lock:
+            i = self.total % self.capacity
+            self.begun[i] = begun
+            self.durations[i] = duration_ms
+            self.kinds[i] = HISTORY_KINDS.index(kind)
+            self.fingers[i] = fingers
+            self.total += 1
+
+    def drain(self):
+        # Records since the last drain, oldest first. If more than
+        # capacity arrived in between, the oldest of them are gone.
+        with self.lock:
+            start = max(self.flushed, self.total - self.capacity)
+            self.dropped += start - self.flushed
+            rows = []
+            for n in range(start, self.total):
+                i = n % self.capacity
+                rows.append((self.begun[i], HISTORY_KINDS[self.kinds[i]], self.fingers[i], self.durations[i]))
+            self.flushed = self.total
+        return rows
+
+HISTORY = GestureHistory()
+
+HISTORY_SCHEMA = """CREATE TABLE IF NOT EXISTS gesture_hourly (
+    hour INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    fingers INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    total_ms REAL NOT NULL,
+    max_ms REAL NOT NULL,
+    PRIMARY KEY (hour, kind, fingers))"""
+
+def flush_history(path, history=HISTORY):
+    # Only hourly rollups reach the disk; returns the number of gestures
+    rows = history.drain()
+    if not rows:
+        return 0
+    rollup = {}
+    for begun, kind, fingers, duration in rows:
+        key = (int(begun // 3600) * 3600, kind, fingers)
+        count, total, longest = rollup.get(key, (0, 0.0, 0.0))
+        rollup[key] = (count + 1, total + duration, max(longest, duration))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    db = sqlite3.connect(path)
     try:
-        subprocess.run(
-            ['xinput', 'set-prop', str(device_id), 'libinput Accel Profile Enabled', val.split(',')[0], val.split(',')[1]],
-            check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
-        )
+        with db:
+            db.execute(HISTORY_SCHEMA)
+            db.executemany(
+                "INSERT INTO gesture_hourly VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (hour, kind, fingers) DO UPDATE SET count = count + excluded.count, "
+                "total_ms = total_ms + excluded.total_ms, max_ms = max(max_ms, excluded.max_ms)",
+                [key + value for key, value in rollup.items()])
+    finally:
+        db.close()
+    return len(rows)
+
+def start_history_writer(path, interval, stop=None):
+    stop = stop or threading.Event()
+
+    def loop():
+        while not stop.wait(interval):
+            try:
+                flush_history(path)
+            except Exception as e:
+                print(f"Error writing gesture history: {e}", file=sys.stderr)
+
+    threading.Thread(target=loop, daemon=True).start()
+
+def read_history(path, hours=24):
+    # Per gesture type and finger count over the last `hours`: count,
+    # mean and longest duration. Aggregated in SQLite from the rollups.
+    if not os.path.exists(path):
+        return []
+    db = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        return db.execute(
+            "SELECT kind, fingers, SUM(count), SUM(total_ms) / SUM(count), MAX(max_ms) "
+            "FROM gesture_hourly WHERE hour >= ? GROUP BY kind, fingers ORDER BY SUM(count) DESC",
+            (int(time.time() // 3600 - hours + 1) * 3600,)).fetchall()
+    except sqlite3.OperationalError:
+        return []
+    finally:
+        db.close()
+
+class XinputWriter:
+    # Fallback backend: one `xinput set-prop` fork/exec per property
+    name = 'xinput'
+
+    def __init__(self, device_id):
+        self.device_id = str(device_id)
+
+    def write(self, props):
+        ok = True
+        for prop, values in props:
+            start = time.perf_counter()
+            try:
+                STATS.count('subprocess_spawns')
+                subprocess.run(
+                    ['xinput', 'set-prop', self.device_id, prop] + [str(v) for v in values],
+                    check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+                )
+            except Exception as e:
+                STATS.count('errors')
+                print(f"Error setting {prop}: {e}", file=sys.stderr)
+                ok = False
+            STATS.observe(f'write {prop}', time.perf_counter() - start)
+        return ok
+
+    def close(self):
+        pass
+
+class XlibWriter:
+    # Holds a single X connection for the daemon's lifetime and writes
+    # properties with XIChangeProperty, flushing once per batch
+    name = 'xlib'
+
+    def __init__(self, device_id):
+        from Xlib import X, display
+        self.X = X
+        self.device_id = int(device_id)
+        self.display = display.Display()
+        if not self.display.has_extension('XInputExtension'):
+            self.display.close()
+            raise RuntimeError("XInputExtension not available")
+        self.float_atom = self.display.intern_atom('FLOAT')
+        self.prop_info = {}
+
+    def _info(self, prop):
+        if prop not in self.prop_info:
+            atom = self.display.intern_atom(prop, only_if_exists=True)
+            if not atom:
+                raise RuntimeError(f"Unknown property: {prop}")
+            reply = self.display.xinput_get_device_property(self.device_id, atom, self.X.AnyPropertyType, 0, 0)
+            if not reply.type or not reply.value:
+                raise RuntimeError(f"Device {self.device_id} has no property: {prop}")
+            self.prop_info[prop] = (atom, reply.type, reply.value[0])
+        return self.prop_info[prop]
+
+    def write(self, props):
+        try:
+            for prop, values in props:
+                start = time.perf_counter()
+                atom, prop_type, fmt = self._info(prop)
+                if prop_type == self.float_atom:
+                    data = list(struct.unpack(f'{len(values)}I', struct.pack(f'{len(values)}f', *values)))
+                else:
+                    data = [int(v) for v in values]
+                self.display.xinput_change_device_property(
+                    self.device_id, atom, prop_type, self.X.PropModeReplace, (fmt, data))
+                STATS.observe(f'write {prop}', time.perf_counter() - start)
+            # Round-trip so the write is applied (and errors surface) before we return
+            start = time.perf_counter()
+            self.display.sync()
+            STATS.observe('write sync', time.perf_counter() - start)
+            return True
+        except Exception as e:
+            STATS.count('errors')
+            print(f"Error writing properties via Xlib: {e}", file=sys.stderr)
+            return False
+
+    def close(self):
+        try:
+            self.display.close()
+        except Exception:
+            pass
+
+class FakeWriter:
+    # Property sink for replay and benchmarks: counts writes instead of touching X
+    name = 'fake'
+
+    def __init__(self, device_id=None):
+        self.writes = 0
+        self.last_props = None
+
+    def write(self, props):
+        self.writes += 1
+        self.last_props = props
+        return True
+
+    def close(self):
+        pass
+
+def same_values(current, values):
+    # list-props prints floats with 6 decimals; newer libinput also reports
+    # more Accel Profile slots than we write, so compare the written prefix
+    if current is None or len(current) < len(values):
+        return False
+    for old, new in zip(current, values):
+        if isinstance(old, str) or isinstance(new, str):
+            if str(old) != str(new):
+                return False
+        elif abs(old - new) > 1e-5:
+            return False
+    return True
+
+class ShadowWriter:
+    # Keeps the last known value of each managed property and only passes
+    # the ones that differ on to the backend, as a single batch
+    def __init__(self, writer, props=None):
+        self.writer = writer
+        self.name = writer.name
+        self.shadow = dict(props or {})
+        self.writes = 0
+        self.avoided = 0
+
+    def write(self, props):
+        changed = [(prop, values) for prop, values in props if not same_values(self.shadow.get(prop), values)]
+        avoided = len(props) - len(changed)
+        if avoided:
+            self.avoided += avoided
+            STATS.count('writes_avoided', avoided)
+        if not changed:
+            return True
+        self.writes += len(changed)
+        STATS.count('writes', len(changed))
+        ok = self.writer.write(changed)
+        for prop, values in changed:
+            if ok:
+                self.shadow[prop] = list(values)
+            else:
+                # Unknown device state, write again next time
+                self.shadow.pop(prop, None)
+        return ok
+
+    def retarget(self, writer):
+        # New backend (e.g. the device came back with a new X ID): the old
+        # shadow no longer describes it
+        self.writer.close()
+        self.writer = writer
+        self.name = writer.name
+        self.shadow.clear()
+
+    def close(self):
+        self.writer.close()
+
+WRITERS = {'xlib': XlibWriter, 'xinput': XinputWriter, 'fake': FakeWriter}
+
+def make_writer(device_id, backend='auto'):
+    if backend != 'auto':
+        return WRITERS[backend](device_id)
+    try:
+        return XlibWriter(device_id)
     except Exception as e:
-        print(f"Error setting profile: {e}", file=sys.stderr)
+        print(f"Xlib backend unavailable ({e}), falling back to xinput", file=sys.stderr)
+        return XinputWriter(device_id)
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+def format_latency(samples, unit='ms'):
+    if not samples:
+        return "n=0"
+    mean = sum(samples) / len(samples)
+    return (f"n={len(samples)} mean={mean:.2f}{unit} p50={percentile(samples, 50):.2f}{unit} "
+            f"p95={percentile(samples, 95):.2f}{unit} max={max(samples):.2f}{unit}")
+
+def bench_writers(device_id, normal_ctm, gesture_ctm, initial_profile, transitions):
+    # Toggle begin/end transitions on the real device with each backend
+    begin = transition_props(gesture_ctm, 'flat')
+    end = transition_props(normal_ctm, initial_profile)
+    for backend in ('xlib', 'xinput'):
+        try:
+            writer = make_writer(device_id, backend)
+        except Exception as e:
+            print(f"{backend}: unavailable ({e})")
+            continue
+        samples = []
+        for i in range(transitions):
+            start = time.perf_counter()
+            writer.write(begin if i % 2 == 0 else end)
+            samples.append((time.perf_counter() - start) * 1000)
+        writer.write(end)
+        writer.close()
+        print(f"{backend}: {format_latency(samples)}")
+
+# struct input_event: struct timeval, __u16 type, __u16 code, __s32 value
+EVENT_FORMAT = 'llHHi'
+EVENT_SIZE = struct.calcsize(EVENT_FORMAT)
+EV_SYN = 0x00
+EV_KEY = 0x01
+EV_ABS = 0x03
+SYN_REPORT = 0
+ABS_MT_SLOT = 0x2f
+ABS_MT_TRACKING_ID = 0x39
+TOOL_FINGERS = {
+    0x145: 1,  # BTN_TOOL_FINGER
+    0x14d: 2,  # BTN_TOOL_DOUBLETAP
+    0x14e: 3,  # BTN_TOOL_TRIPLETAP
+    0x14f: 4,  # BTN_TOOL_QUADTAP
+    0x148: 5,  # BTN_TOOL_QUINTTAP
+}
+GESTURE_MIN_FINGERS = 3
+
+class EvdevGestureTracker:
+    # Tracks multitouch slots and BTN_TOOL_* state, emitting gesture
+    # begin/end on SYN_REPORT frames where the finger count crosses 3
+    def __init__(self):
+        self.slot = 0
+        self.slots = set()
+        self.tool_fingers = 0
+        self.active = False
+
+    def feed(self, ev_type, code, value, stamp=0.0):
+        if ev_type == EV_ABS:
+            if code == ABS_MT_SLOT:
+                self.slot = value
+            elif code == ABS_MT_TRACKING_ID:
+                if value < 0:
+                    self.slots.discard(self.slot)
+                else:
+                    self.slots.add(self.slot)
+        elif ev_type == EV_KEY:
+            fingers = TOOL_FINGERS.get(code)
+            if fingers:
+                if value:
+                    self.tool_fingers = fingers
+                elif self.tool_fingers == fingers:
+                    self.tool_fingers = 0
+        elif ev_type == EV_SYN and code == SYN_REPORT:
+            # Touchpads with fewer slots than fingers report the rest via BTN_TOOL_*
+            fingers = max(len(self.slots), self.tool_fingers)
+            # evdev can't tell swipe from pinch/hold; multi-finger contact counts as a swipe
+            if not self.active and fingers >= GESTURE_MIN_FINGERS:
+                self.active = True
+                return ('begin', fingers, 'swipe', stamp)
+            if self.active and fingers < GESTURE_MIN_FINGERS:
+                self.active = False
+                return ('end', fingers, 'swipe', stamp)
+        return None
+
+def parse_evdev(tracker, data):
+    # data holds whole input_event structs
+    found = []
+    for sec, usec, ev_type, code, value in struct.iter_unpack(EVENT_FORMAT, data):
+        event = tracker.feed(ev_type, code, value, sec + usec * 1e-6)
+        if event:
+            found.append(event)
+    return found
+
+# libinput debug-events event type column -> (gesture kind, phase).
+# Lines stay raw bytes; nothing is decoded.
+LIBINPUT_EVENTS = {
+    b'GESTURE_SWIPE_BEGIN': ('swipe', 'begin'),
+    b'GESTURE_SWIPE_END': ('swipe', 'end'),
+    b'GESTURE_PINCH_BEGIN': ('pinch', 'begin'),
+    b'GESTURE_PINCH_END': ('pinch', 'end'),
+    b'GESTURE_HOLD_BEGIN': ('hold', 'begin'),
+    b'GESTURE_HOLD_END': ('hold', 'end'),
+}
+GESTURE_TAG = b'GESTURE_'
+# "-event13  " pads the device name, so the event type starts at a fixed
+# offset for a given device
+LIBINPUT_TYPE_COLUMN = 10
+
+def libinput_type_column(line):
+    column = line.find(b' ', 1)
+    if column < 0:
+        return LIBINPUT_TYPE_COLUMN
+    while line[column:column + 1] == b' ':
+        column += 1
+    return column
+
+def parse_libinput_line(line, column=LIBINPUT_TYPE_COLUMN):
+    # b" event13  GESTURE_SWIPE_BEGIN     +3.012s	3". An 8-byte compare at
+    # the type column rejects POINTER_MOTION/TOUCH lines without decoding
+    if line[column:column + 8] != GESTURE_TAG:
+        return None
+    end = line.find(b' ', column)
+    kind_phase = LIBINPUT_EVENTS.get(line[column:end])
+    if kind_phase is None:
+        return None
+    try:
+        # "+3.012s" is the libinput event time
+        stamp, fingers = line[end:].split(None, 2)[:2]
+        return (kind_phase[1], int(fingers), kind_phase[0], float(stamp[1:-1]))
+    except (ValueError, IndexError):
+        return None
+
+def evdev_events(stream):
+    tracker = EvdevGestureTracker()
+    pending = b''
+    while True:
+        start = time.perf_counter()
+        data = stream.read(EVENT_SIZE * 64)
+        now = time.perf_counter()
+        STATS.observe('read', now - start)
+        if not data:
+            return
+        STATS.last_read = now
+        if pending:
+            data = pending + data
+        usable = len(data) - len(data) % EVENT_SIZE
+        pending = data[usable:]
+        STATS.count('events', usable // EVENT_SIZE)
+        found = parse_evdev(tracker, data[:usable])
+        STATS.observe('parse', time.perf_counter() - now)
+        yield from found
+
+def libinput_events(stream):
+    readline = stream.readline
+    column = None
+    while True:
+        start = time.perf_counter()
+        line = readline()
+        now = time.perf_counter()
+        STATS.observe('read', now - start)
+        if not line:
+            return
+        STATS.last_read = now
+        STATS.count('lines')
+        if column is None:
+            column = libinput_type_column(line)
+        # Most lines stop here, before any parsing
+        if line[column:column + 8] != GESTURE_TAG:
+            continue
+        event = parse_libinput_line(line, column)
+        STATS.observe('parse', time.perf_counter() - now)
+        if event:
+            yield event
+
+def open_event_source(event_node, input_mode, record_path=None, source_cmd=None):
+    # Returns (events, close)
+    if input_mode in ('auto', 'evdev') and not source_cmd:
+        try:
+            device = open(event_node, 'rb', buffering=0)
+            if record_path:
+                device = RecordingStream(device, record_path, RECORD_EVDEV)
+            return evdev_events(device), device.close
+        except OSError as e:
+            if input_mode == 'evdev':
+                raise
+            print(f"Cannot read {event_node} directly ({e}), using libinput debug-events", file=sys.stderr)
+
+    if source_cmd:
+        cmd = [part.replace('{node}', event_node) for part in shlex.split(source_cmd)]
+    else:
+        cmd = ['sudo', 'libinput', 'debug-events', '--device', event_node]
+    STATS.count('subprocess_spawns')
+    # stderr is never read; a pipe would fill with libinput's warnings and stall it
+    process = subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL
+    )
+    if record_path:
+        stream = RecordingStream(process.stdout, record_path, RECORD_LIBINPUT)
+        def close():
+            stream.close()
+            process.terminate()
+        return libinput_events(stream), close
+    return libinput_events(process.stdout), process.terminate
+
+# Record file: gzip of RECORD_MAGIC + kind, then per read a
+# (seconds since start, payload length) header followed by the payload
+RECORD_MAGIC = b'GDREC1'
+RECORD_EVDEV = b'e'
+RECORD_LIBINPUT = b'l'
+RECORD_HEADER = struct.Struct('<dI')
+
+class RecordingStream:
+    # Tees everything read from the event source into a record file
+    def __init__(self, stream, path, kind):
+        self.stream = stream
+        self.out = gzip.open(path, 'wb')
+        self.out.write(RECORD_MAGIC + kind)
+        self.start = time.monotonic()
+
+    def _record(self, data):
+        if data:
+            payload = data.encode() if isinstance(data, str) else data
+            self.out.write(RECORD_HEADER.pack(time.monotonic() - self.start, len(payload)) + payload)
+        return data
+
+    def read(self, size):
+        return self._record(self.stream.read(size))
+
+    def readline(self):
+        return self._record(self.stream.readline())
+
+    def close(self):
+        self.out.close()
+        self.stream.close()
+
+class ReplayStream:
+    # Plays a record file back through read()/readline(). speed 1.0 is
+    # real time, higher is accelerated, 0 delivers as fast as possible.
+    def __init__(self, path, speed=1.0):
+        with gzip.open(path, 'rb') as f:
+            data = f.read()
+        if data[:len(RECORD_MAGIC)] != RECORD_MAGIC:
+            raise ValueError(f"{path} is not a gesture daemon recording")
+        self.kind = data[len(RECORD_MAGIC):len(RECORD_MAGIC) + 1]
+        self.records = []
+        pos = len(RECORD_MAGIC) + 1
+        while pos < len(data):
+            offset, length = RECORD_HEADER.unpack_from(data, pos)
+            pos += RECORD_HEADER.size
+            self.records.append((offset, data[pos:pos + length]))
+            pos += length
+        self.speed = speed
+        self.index = 0
+        self.start = None
+        self.last_delivery = 0.0
+
+    def units(self):
+        if self.kind == RECORD_EVDEV:
+            return sum(len(payload) for _, payload in self.records) // EVENT_SIZE
+        return len(self.records)
+
+    def events(self):
+        return evdev_events(self) if self.kind == RECORD_EVDEV else libinput_events(self)
+
+    def _next(self):
+        if self.index >= len(self.records):
+            return None
+        offset, payload = self.records[self.index]
+        self.index += 1
+        if self.speed > 0:
+            if self.start is None:
+                self.start = time.perf_counter() - offset / self.speed
+            delay = self.start + offset / self.speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        self.last_delivery = time.perf_counter()
+        return payload
+
+    def read(self, size):
+        return self._next() or b''
+
+    def readline(self):
+        return self._next() or b''
+
+    def close(self):
+        pass
+
+def replay(path, speed, writer, params, verbose=True):
+    stream = ReplayStream(path, speed)
+    latencies = []
+
+    def on_transition(phase):
+        if phase == 'begin':
+            latencies.append((time.perf_counter() - stream.last_delivery) * 1000)
+
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    run_loop(stream.events(), writer, params, on_transition, verbose)
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
 
-def get_current_profile(device_id):
+    units = stream.units()
+    print(f"Replayed {units} events in {elapsed:.3f}s ({units / max(elapsed, 1e-9):.0f} events/sec, "
+          f"{cpu * 1000:.1f} ms CPU, {writer.name} sink)")
+    print(f"Begin -> CTM applied: {format_latency(latencies)}")
+    if isinstance(writer, ShadowWriter):
+        print(f"Property writes: {writer.writes}, avoided: {writer.avoided}")
+
+def bench_input(evdev_path, libinput_path):
+    # Compare daemon-side CPU cost of both input pipelines on recordings of
+    # the same session (e.g. `sudo cat /dev/input/eventN > touch.evdev` and
+    # `sudo libinput debug-events --device /dev/input/eventN > touch.log`)
+    with open(evdev_path, 'rb') as f:
+        raw = f.read()
+    with open(libinput_path, 'rb') as f:
+        text = f.read()
+
+    events = len(raw) // EVENT_SIZE
+    start = time.process_time()
+    evdev_gestures = sum(1 for _ in evdev_events(io.BytesIO(raw)))
+    evdev_cpu = time.process_time() - start
+
+    lines = text.count(b'\n')
+    start = time.process_time()
+    libinput_gestures = sum(1 for _ in libinput_events(io.BytesIO(text)))
+    libinput_cpu = time.process_time() - start
+
+    print(f"evdev:    {events} events, {evdev_gestures} transitions, "
+          f"{evdev_cpu * 1000:.1f} ms CPU, {evdev_cpu * 1e6 / max(events, 1):.2f} us/event")
+    print(f"libinput: {lines} lines, {libinput_gestures} transitions, "
+          f"{libinput_cpu * 1000:.1f} ms CPU, {libinput_cpu * 1e6 / max(lines, 1):.2f} us/line "
+          f"(excludes the libinput process itself)")
+
+SYNTHETIC_MOTION = [b'POINTER_MOTION', b'TOUCH_MOTION', b'POINTER_MOTION', b'TOUCH_FRAME']
+
+def synthetic_line(index, seconds, gesture_every, gesture_len=20):
+    # One debug-events line: a 3-finger swipe (begin, updates, end) every
+    # gesture_every lines, pointer motion and touch lines in between
+    stamp = f"+{seconds:.3f}s".encode()
+    step = index % gesture_every
+    if step == 0:
+        return b' event13  GESTURE_SWIPE_BEGIN     ' + stamp + b'\t3\n'
+    if step < gesture_len:
+        return b' event13  GESTURE_SWIPE_UPDATE    ' + stamp + b'\t3  1.20/ 0.40 ( 3.10/ 1.02 unaccelerated)\n'
+    if step == gesture_len:
+        return b' event13  GESTURE_SWIPE_END       ' + stamp + b'\t3\n'
+    return b'-event13  ' + SYNTHETIC_MOTION[index % 4].ljust(24) + stamp + b'\t  0.00/  1.00 ( +0.00/ +1.00)\n'
+
+def synthetic_libinput_log(lines=100000, gesture_every=500):
+    return [synthetic_line(i, i / 1000, gesture_every) for i in range(lines)]
+
+# --bench scenarios: default lines/sec, gesture_every, gesture_len
+BENCH_SCENARIOS = {
+    # Heavy pointer use: motion flood with a swipe every second
+    'motion': (2000, 2000, 20),
+    # Swipes back to back
+    'bursts': (500, 22, 20),
+    # Nothing but a begin/end pair every few seconds
+    'idle': (0.5, 2, 1),
+}
+
+def generate_stream(scenario, rate, seconds, out):
+    # Writes a paced synthetic debug-events stream, flushed every 10 ms
+    # (or per line when slower than that)
+    default_rate, gesture_every, gesture_len = BENCH_SCENARIOS[scenario]
+    rate = rate or default_rate
+    total = max(1, int(rate * seconds))
+    per_tick = max(1, int(rate / 100))
+    start = time.perf_counter()
+    index = 0
+    try:
+        while index < total:
+            end = min(index + per_tick, total)
+            out.write(b''.join(synthetic_line(i, i / rate, gesture_every, gesture_len) for i in range(index, end)))
+            out.flush()
+            index = end
+            delay = start + index / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+    except BrokenPipeError:
+        pass
+
+def bench(scenario, rate, seconds, engine, params):
+    # Drives the daemon's real libinput pipeline from a generator process
+    # against a fake property sink. Prints one JSON object; CPU and
+    # wakeups are this process only, not the generator.
+    default_rate = BENCH_SCENARIOS[scenario][0]
+    cmd = shlex.join([sys.executable, os.path.abspath(__file__), '--bench-generate', scenario,
+                      '--bench-rate', str(rate or default_rate), '--bench-seconds', str(seconds)])
+    writer = ShadowWriter(FakeWriter())
+    before = dict(STATS.counters)
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.perf_counter()
+    if engine == 'async':
+        asyncio.run(run_engine(async_event_source('', 'libinput', cmd), writer, params,
+                               {'close': None}, verbose=False))
+    else:
+        events, close = open_event_source('', 'libinput', source_cmd=cmd)
+        try:
+            run_loop(events, writer, params, verbose=False)
+        finally:
+            close()
+    elapsed = time.perf_counter() - start
+    end_usage = resource.getrusage(resource.RUSAGE_SELF)
+    writer.close()
+
+    lines = STATS.counters['lines'] - before['lines']
+    cpu = (end_usage.ru_utime - usage.ru_utime) + (end_usage.ru_stime - usage.ru_stime)
+    # Voluntary context switches: each is the process going to sleep and
+    # being woken again
+    wakeups = end_usage.ru_nvcsw - usage.ru_nvcsw
+    result = {
+        'scenario': scenario,
+        'engine': engine,
+        'rate': rate or default_rate,
+        'seconds': round(elapsed, 3),
+        'lines': lines,
+        'gestures': STATS.counters['gestures'] - before['gestures'],
+        'writes': writer.writes,
+        'writes_avoided': writer.avoided,
+        'lines_per_sec': round(lines / max(elapsed, 1e-9), 1),
+        'cpu_ms': round(cpu * 1000, 1),
+        'cpu_ms_per_10k_lines': round(cpu * 1000 * 10000 / max(lines, 1), 2),
+        'wakeups_per_sec': round(wakeups / max(elapsed, 1e-9), 1),
+        # ru_maxrss is the process-wide peak, so with --bench all it also
+        # covers the scenarios that ran before this one
+        'process_peak_rss_kb': end_usage.ru_maxrss,
+        'python': sys.version.split()[0],
+    }
+    print(json.dumps(result), flush=True)
+    return result
+
+def bench_classify(path, rules, rate=1000):
+    # Per-line classification cost before and after the bytes fast path.
+    # CPU% is projected for a stream of `rate` lines/sec.
+    if path:
+        with open(path, 'rb') as f:
+            lines = f.read().splitlines(keepends=True)
+    else:
+        lines = synthetic_libinput_log()
+
+    def substring_chain(line):
+        # The loop as it was: decode, then substring checks
+        line = line.decode(errors='replace')
+        if 'GESTURE_SWIPE_BEGIN' in line:
+            try:
+                fingers = int(line.split()[-1])
+                if fingers >= 3:
+                    return True
+            except ValueError:
+                pass
+        elif 'GESTURE_SWIPE_END' in line:
+            return True
+        return False
+
+    column = libinput_type_column(lines[0]) if lines else LIBINPUT_TYPE_COLUMN
+
+    def fast_path(line):
+        if line[column:column + 8] != GESTURE_TAG:
+            return False
+        event = parse_libinput_line(line, column)
+        if event is None:
+            return False
+        return event[0] == 'end' or rules.match(event[2], event[1]) is not None
+
+    source = path or 'synthetic stream'
+    for name, classify in (('decode + substring chain', substring_chain), ('bytes fast path', fast_path)):
+        start = time.perf_counter()
+        cpu_start = time.process_time()
+        hits = sum(1 for line in lines if classify(line))
+        elapsed = time.perf_counter() - start
+        cpu = time.process_time() - cpu_start
+        print(f"{name}: {len(lines)} lines ({source}), {hits} gesture lines, "
+              f"{len(lines) / max(elapsed, 1e-9):.0f} lines/sec, "
+              f"{cpu * 1e6 / max(len(lines), 1):.3f} us/line, "
+              f"{cpu / max(len(lines), 1) * rate * 100:.3f}% CPU at {rate} lines/sec")
+
+def list_props(device_id):
+    # One `xinput list-props` read, parsed into {name: [values]}
+    props = {}
     try:
+        STATS.count('subprocess_spawns')
         output = subprocess.check_output(
             ['xinput', 'list-props', str(device_id)],
             text=True
         )
-        for line in output.splitlines():
-            if 'libinput Accel Profile Enabled (' in line:
-                parts = line.split(':')[1].strip().split(',')
-                if parts[0].strip() == '1':
-                    return 'adaptive'
-                elif parts[1].strip() == '1':
-                    return 'flat'
     except Exception as e:
-        print(f"Error reading profile: {e}", file=sys.stderr)
+        STATS.count('errors')
+        print(f"Error reading properties: {e}", file=sys.stderr)
+        return props
+    for line in output.splitlines():
+        # Coordinate Transformation Matrix (170):	1.000000, 0.000000, ...
+        match = re.match(r'\s+(.+?) \(\d+\):\s*(.*)$', line)
+        if not match:
+            continue
+        values = []
+        for part in match.group(2).split(','):
+            part = part.strip()
+            try:
+                values.append(float(part))
+            except ValueError:
+                values.append(part.strip('"'))
+        props[match.group(1)] = values
+    return props
+
+def get_current_profile(device_id, props=None):
+    if props is None:
+        props = list_props(device_id)
+    values = props.get(PROFILE_PROP)
+    if values and len(values) >= 2:
+        if values[0] == 1:
+            return 'adaptive'
+        elif values[1] == 1:
+            return 'flat'
+        elif len(values) >= 3 and values[2] == 1:
+            return 'custom'
     return 'adaptive'
 
-def main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument('--device', required=True, help="Touchpad Device ID")
-    parser.add_argument('--normal', type=float, default=1.0, help="Normal CTM multiplier")
-    parser.add_argument('--gesture', type=float, default=0.4, help="Gesture (3-finger) CTM multiplier")
-    args = parser.parse_args()
+ABS_X = 0x00
+ABS_MT_POSITION_X = 0x35
+BTN_TOOL_FINGER = 0x145
+INPUT_PROP_POINTER = 0x00
+# Bus of uinput devices, including the uinput engine's "(scaled)" copy
+BUS_VIRTUAL = 0x06
+NETLINK_KOBJECT_UEVENT = 15
 
-    device_id = args.device
-    normal_ctm = args.normal
-    gesture_ctm = args.gesture
+def read_bitmask(path):
+    # sysfs capability masks are hex longs, most significant first
+    try:
+        with open(path) as f:
+            words = f.read().split()
+    except OSError:
+        return 0
+    mask = 0
+    for word in words:
+        mask = (mask << 64) | int(word, 16)
+    return mask
 
-    print(f"Starting Gesture Daemon for Device {device_id}")
-    print(f"Normal CTM: {normal_ctm}, Gesture CTM: {gesture_ctm}")
+class InputDevice:
+    def __init__(self, node, name, abs_caps, key_caps, input_props, bustype=0):
+        self.node = node
+        self.name = name
+        self.abs_caps = abs_caps
+        self.key_caps = key_caps
+        self.input_props = input_props
+        self.bustype = bustype
 
-    # Capture initial profile to restore later
-    initial_profile = get_current_profile(device_id)
-    print(f"Initial Profile: {initial_profile}")
+    @property
+    def is_touchpad(self):
+        # Pointer-type (not direct/touchscreen) device with finger tracking,
+        # not a virtual copy such as the uinput engine's
+        return (self.bustype != BUS_VIRTUAL
+                and bool(self.abs_caps >> ABS_MT_POSITION_X & 1 or self.abs_caps >> ABS_X & 1)
+                and bool(self.key_caps >> BTN_TOOL_FINGER & 1)
+                and bool(self.input_props >> INPUT_PROP_POINTER & 1))
 
-    # Ensure we start with normal CTM and initial profile
-    set_ctm(device_id, normal_ctm)
-    set_profile(device_id, initial_profile)
+class DeviceRegistry:
+    # Input devices read once from sysfs, then kept current from kernel
+    # uevents on a netlink socket. X IDs are resolved lazily with a single
+    # `xinput list` and cached until a hotplug invalidates them.
+    def __init__(self, sysfs_root='/sys/class/input'):
+        self.sysfs_root = sysfs_root
+        self.devices = {}
+        self.xids = None
+        self.listeners = []
+        self.lock = threading.Lock()
 
-    # Start libinput debug-events
-    event_node = find_event_node(device_id)
-    if not event_node:
-        print("Could not find event node for device.", file=sys.stderr)
-        return
+    def scan(self):
+        try:
+            entries = os.listdir(self.sysfs_root)
+        except OSError as e:
+            print(f"Error listing input devices: {e}", file=sys.stderr)
+            return
+        devices = {}
+        for entry in entries:
+            if entry.startswith('event'):
+                device = self._read_device(entry)
+                if device:
+                    devices[device.node] = device
+        with self.lock:
+            self.devices = devices
 
-    print(f"Monitoring {event_node}...")
-    
-    process = subprocess.Popen(
-        ['sudo', 'libinput', 'debug-events', '--device', event_node],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True,
-        bufsize=1
-    )
+    def _read_device(self, event_name):
+        base = os.path.join(self.sysfs_root, event_name, 'device')
+        try:
+            with open(os.path.join(base, 'name')) as f:
+                name = f.read().strip()
+        except OSError:
+            return None
+        return InputDevice(
+            os.path.join('/dev/input', event_name), name,
+            read_bitmask(os.path.join(base, 'capabilities', 'abs')),
+            read_bitmask(os.path.join(base, 'capabilities', 'key')),
+            read_bitmask(os.path.join(base, 'properties')),
+            read_bitmask(os.path.join(base, 'id', 'bustype')),
+        )
 
-    # Handle exit signals to restore CTM
-    def signal_handler(sig, frame):
-        print("\nExiting... Restoring Normal CTM and Profile.")
-        set_ctm(device_id, normal_ctm)
-        set_profile(device_id, initial_profile)
-        process.terminate()
-        sys.exit(0)
+    def subscribe(self, callback):
+        # callback(action, device) runs on the monitor thread
+        self.listeners.append(callback)
 
-    signal.signal(signal.SIGINT, signal_handler)
-    signal.signal(signal.SIGTERM, signal_handler)
+    def touchpad(self):
+        for node in sorted(self.devices):
+            if self.devices[node].is_touchpad:
+                return self.devices[node]
+        return None
+
+    def handle_uevent(self, data):
+        # Kernel uevent: "add@/devices/...\0ACTION=add\0SUBSYSTEM=input\0DEVNAME=input/event13\0..."
+        fields = data.split(b'\0')
+        env = {}
+        for field in fields[1:]:
+            key, sep, value = field.partition(b'=')
+            if sep:
+                env[key.decode(errors='replace')] = value.decode(errors='replace')
+        devname = env.get('DEVNAME', '')
+        if env.get('SUBSYSTEM') != 'input' or not devname.startswith('input/event'):
+            return None
+        action = env.get('ACTION')
+        event_name = devname.split('/')[-1]
+        node = '/dev/' + devname
+        with self.lock:
+            if action == 'add':
+                device = self._read_device(event_name)
+                if not device:
+                    return None
+                self.devices[node] = device
+            elif action == 'remove':
+                device = self.devices.pop(node, None)
+                if not device:
+                    return None
+            else:
+                return None
+            # Any hotplug can renumber X devices
+            self.xids = None
+        for callback in self.listeners:
+            try:
+                callback(action, device)
+            except Exception as e:
+                print(f"Error in device listener: {e}", file=sys.stderr)
+        return action, device
+
+    def start_monitor(self):
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+        # Multicast group 1 carries the kernel's own uevents
+        sock.bind((0, 1))
+
+        def loop():
+            while True:
+                try:
+                    data = sock.recv(16384)
+                except OSError:
+                    return
+                if not data.startswith(b'libudev'):
+                    self.handle_uevent(data)
 
-    # Track current state to avoid redundant calls
-    is_gesture_active = False
+        threading.Thread(target=loop, daemon=True).start()
+        return sock
 
+    def _load_xids(self):
+        xids = {}
+        try:
+            STATS.count('subprocess_spawns')
+            output = subprocess.check_output(['xinput', 'list'], text=True)
+        except Exception as e:
+            print(f"Error listing X devices: {e}", file=sys.stderr)
+            return xids
+        for line in output.splitlines():
+            # ⎜   ↳ SynPS/2 Synaptics TouchPad    	id=12	[slave  pointer  (2)]
+            match = re.search(r'^[\W\s]*(.+?)\s+id=(\d+)\s+\[slave\s+pointer', line)
+            if match:
+                xids.setdefault(match.group(1), match.group(2))
+        return xids
+
+    def invalidate_xids(self):
+        with self.lock:
+            self.xids = None
+
+    def xid_for(self, device):
+        with self.lock:
+            if self.xids is None:
+                self.xids = self._load_xids()
+            return self.xids.get(device.name)
+
+def load_settings(path=CONFIG_PATH):
+    # Same file and defaults as TouchpadTuner.load_config
+    settings = {'profile': 'adaptive', 'normal_ctm': 1.0, 'gesture_ctm': 0.4,
+                'daemon_enabled': True, 'scroll_dist': 15, 'custom_curve': DEFAULT_CURVE}
+    try:
+        with open(path, 'r') as f:
+            settings.update(json.load(f))
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"Error loading config: {e}", file=sys.stderr)
+    return settings
+
+def find_touchpad_id():
+    registry = DeviceRegistry()
+    registry.scan()
+    touchpad = registry.touchpad()
+    return registry.xid_for(touchpad) if touchpad else None
+
+def apply_settings(device_id, settings, backend='auto'):
+    # Profile, CTM and scroll distance go out as one batch
+    props = [(CTM_PROP, ctm_values(float(settings['normal_ctm'])))]
+    if settings['profile'] == 'custom':
+        props += custom_curve_props(dict(DEFAULT_CURVE, **settings['custom_curve']))
+    else:
+        props.append((PROFILE_PROP, profile_values(settings['profile'])))
+    props.append((SCROLL_PROP, [int(settings['scroll_dist'])]))
+    writer = make_writer(device_id, backend)
     try:
+        ok = writer.write(props)
+    finally:
+        writer.close()
+    # gsettings persists speed itself; only push it if the tuner saved one
+    if settings.get('speed') is not None:
+        try:
+            STATS.count('subprocess_spawns')
+            subprocess.run(
+                ['gsettings', 'set', 'org.gnome.desktop.peripherals.touchpad', 'speed', str(float(settings['speed']))],
+                check=True
+            )
+        except Exception as e:
+            print(f"Error setting speed: {e}", file=sys.stderr)
+            ok = False
+    return ok
+
+class FocusWatcher:
+    # Reports the focused application's WM_CLASS whenever the window
+    # manager updates _NET_ACTIVE_WINDOW on the root window. Event driven:
+    # the thread blocks in next_event() between focus changes.
+    def __init__(self, on_change):
+        from Xlib import X, display, error
+        self.X = X
+        self.XError = error.XError
+        self.on_change = on_change
+        self.display = display.Display()
+        self.root = self.display.screen().root
+        self.active_atom = self.display.intern_atom('_NET_ACTIVE_WINDOW')
+        # window id -> WM_CLASS class name
+        self.classes = {}
+        self.current = None
+
+    def active_class(self):
+        prop = self.root.get_full_property(self.active_atom, self.X.AnyPropertyType)
+        if not prop or not prop.value:
+            return None
+        window_id = prop.value[0]
+        if window_id not in self.classes:
+            if len(self.classes) > 256:
+                # Window ids get reused; don't let stale entries pile up
+                self.classes.clear()
+            try:
+                wm_class = self.display.create_resource_object('window', window_id).get_wm_class()
+            except self.XError:
+                return None
+            self.classes[window_id] = wm_class[1] if wm_class else None
+        return self.classes[window_id]
+
+    def run(self):
+        self.root.change_attributes(event_mask=self.X.PropertyChangeMask)
+        self._report()
         while True:
-            line = process.stdout.readline()
-            if not line:
-                break
-            
-            # Check for GESTURE_SWIPE_BEGIN/END
-            if 'GESTURE_SWIPE_BEGIN' in line:
-                parts = line.split()
-                try:
-                    fingers = int(parts[-1])
-                    if fingers >= 3:
-                        print(f"Gesture Begin ({fingers} fingers) -> Low Sensitivity & Flat Profile")
-                        set_ctm(device_id, gesture_ctm)
-                        set_profile(device_id, 'flat')
-                        is_gesture_active = True
-                except ValueError:
-                    pass
-            
-            elif 'GESTURE_SWIPE_END' in line:
-                if is_gesture_active:
-                    print("Gesture End -> Normal Sensitivity & Restore Profile")
-                    set_ctm(device_id, normal_ctm)
-                    set_profile(device_id, initial_profile)
-                    is_gesture_active = False
+            event = self.display.next_event()
+            if event.type == self.X.PropertyNotify and event.atom == self.active_atom:
+                self._report()
+
+    def _report(self):
+        wm_class = self.active_class()
+        if wm_class != self.current:
+            self.current = wm_class
+            self.on_change(wm_class)
+
+    def start(self):
+        thread = threading.Thread(target=self.run, daemon=True)
+        thread.start()
+        return thread
+
+def watch_focus():
+    # Prints each focus change, e.g. under Xvfb while a script switches
+    # windows with `xdotool windowactivate`
+    last = [time.perf_counter()]
 
+    def on_change(wm_class):
+        now = time.perf_counter()
+        print(f"{wm_class or '-'} ({(now - last[0]) * 1000:.0f} ms since last change)", flush=True)
+        last[0] = now
+
+    FocusWatcher(on_change).run()
+
+MAX_FINGERS = 5
+# The original behaviour: any swipe with 3 or more fingers
+DEFAULT_RULES = [{'type': 'swipe', 'fingers': '3+'}]
+
+class GestureRules:
+    # Declarative rules compiled once into {(kind, fingers): rule}. A rule
+    # without 'ctm' follows the live gesture multiplier; 'profile' defaults
+    # to flat and 'scroll_dist' is only written when given.
+    def __init__(self, rules):
+        self.table = {}
+        self.scroll = False
+        self.kinds = set()
+        for rule in rules:
+            kind = rule.get('type', 'swipe')
+            self.kinds.add(kind)
+            fingers = rule.get('fingers', '3+')
+            if isinstance(fingers, str) and fingers.endswith('+'):
+                counts = range(int(fingers[:-1]), MAX_FINGERS + 1)
+            elif isinstance(fingers, list):
+                counts = fingers
+            else:
+                counts = [fingers]
+            compiled = {
+                'kind': kind,
+                'ctm': float(rule['ctm']) if rule.get('ctm') is not None else None,
+                'profile': rule.get('profile', 'flat'),
+                'scroll_dist': int(rule['scroll_dist']) if rule.get('scroll_dist') is not None else None,
+            }
+            if compiled['scroll_dist'] is not None:
+                self.scroll = True
+            for count in counts:
+                # First matching rule wins
+                self.table.setdefault((kind, int(count)), compiled)
+
+    def match(self, kind, fingers):
+        return self.table.get((kind, fingers))
+
+    @property
+    def needs_libinput(self):
+        # The evdev reader only tells finger counts apart, every 3+ finger
+        # contact comes out as a swipe
+        return bool(self.kinds - {'swipe'})
+
+def load_rules(path=CONFIG_PATH):
+    # 'gesture_rules' in the tuner's config.json, e.g.
+    # [{"type": "swipe", "fingers": 3, "ctm": 0.4, "profile": "flat", "scroll_dist": 30}]
+    try:
+        with open(path, 'r') as f:
+            rules = json.load(f).get('gesture_rules')
+        if rules:
+            return GestureRules(rules)
+    except FileNotFoundError:
+        pass
     except Exception as e:
-        print(f"Error in loop: {e}", file=sys.stderr)
+        print(f"Error loading gesture rules: {e}", file=sys.stderr)
+    return GestureRules(DEFAULT_RULES)
+
+class GestureParams:
+    # Live settings shared by the event loop and the control socket. The
+    # lock covers both the state and the property write that reflects it.
+    def __init__(self, normal_ctm, gesture_ctm, initial_profile, rules=None, initial_scroll=None):
+        self.normal_ctm = normal_ctm
+        self.gesture_ctm = gesture_ctm
+        self.initial_profile = initial_profile
+        self.rules = rules or GestureRules(DEFAULT_RULES)
+        self.initial_scroll = initial_scroll
+        self.active_rule = None
+        self.lock = threading.RLock()
+
+    @property
+    def gesture_active(self):
+        return self.active_rule is not None
+
+    def normal_props(self):
+        props = transition_props(self.normal_ctm, self.initial_profile)
+        if self.rules.scroll and self.initial_scroll is not None:
+            props.append((SCROLL_PROP, [self.initial_scroll]))
+        return props
+
+    def gesture_props(self):
+        rule = self.active_rule
+        ctm = rule['ctm'] if rule['ctm'] is not None else self.gesture_ctm
+        props = transition_props(ctm, rule['profile'])
+        if rule['scroll_dist'] is not None:
+            props.append((SCROLL_PROP, [rule['scroll_dist']]))
+        return props
+
+    def current_props(self):
+        return self.gesture_props() if self.gesture_active else self.normal_props()
+
+def run_loop(events, writer, params, on_transition=None, verbose=True):
+    for phase, fingers, kind, stamp in events:
+        HISTORY.observe(phase, fingers, kind, stamp)
+        if phase == 'begin':
+            rule = params.rules.match(kind, fingers)
+            if rule:
+                with params.lock:
+                    start = time.perf_counter()
+                    params.active_rule = rule
+                    props = params.gesture_props()
+                    writer.write(props)
+                done = time.perf_counter()
+                elapsed = (done - start) * 1000
+                STATS.count('gestures')
+                STATS.count('transitions')
+                STATS.observe('event to applied', done - STATS.last_read)
+                if on_transition:
+                    on_transition('begin')
+                if verbose:
+                    print(f"Gesture Begin ({fingers}-finger {kind}) -> CTM {props[0][1][0]:.2f} & {rule['profile'].title()} Profile [{writer.name} {elapsed:.1f} ms]")
+        
+        elif phase == 'end':
+            # Track current state to avoid redundant calls
+            if params.gesture_active:
+                with params.lock:
+                    start = time.perf_counter()
+                    params.active_rule = None
+                    writer.write(params.normal_props())
+                done = time.perf_counter()
+                elapsed = (done - start) * 1000
+                STATS.count('transitions')
+                STATS.observe('event to applied', done - STATS.last_read)
+                if on_transition:
+                    on_transition('end')
+                if verbose:
+                    print(f"Gesture End -> Normal Sensitivity & Restore Profile [{writer.name} {elapsed:.1f} ms]")
+
+async def async_event_source(event_node, input_mode, source_cmd=None):
+    # Non-blocking counterpart of open_event_source
+    if input_mode in ('auto', 'evdev') and not source_cmd:
+        try:
+            fd = os.open(event_node, os.O_RDONLY | os.O_NONBLOCK)
+        except OSError as e:
+            if input_mode == 'evdev':
+                raise
+            print(f"Cannot read {event_node} directly ({e}), using libinput debug-events", file=sys.stderr)
+        else:
+            loop = asyncio.get_running_loop()
+            readable = asyncio.Event()
+            loop.add_reader(fd, readable.set)
+            tracker = EvdevGestureTracker()
+            try:
+                while True:
+                    await readable.wait()
+                    readable.clear()
+                    try:
+                        # evdev reads always return whole events
+                        data = os.read(fd, EVENT_SIZE * 64)
+                    except BlockingIOError:
+                        continue
+                    if not data:
+                        return
+                    now = time.perf_counter()
+                    STATS.last_read = now
+                    STATS.count('events', len(data) // EVENT_SIZE)
+                    found = parse_evdev(tracker, data)
+                    STATS.observe('parse', time.perf_counter() - now)
+                    for event in found:
+                        yield event
+            finally:
+                loop.remove_reader(fd)
+                os.close(fd)
+            return
+
+    if source_cmd:
+        cmd = [part.replace('{node}', event_node) for part in shlex.split(source_cmd)]
+    else:
+        cmd = ['sudo', 'libinput', 'debug-events', '--device', event_node]
+    STATS.count('subprocess_spawns')
+    process = await asyncio.create_subprocess_exec(
+        *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL)
+    column = None
+    try:
+        while True:
+            line = await process.stdout.readline()
+            if not line:
+                return
+            now = time.perf_counter()
+            STATS.last_read = now
+            STATS.count('lines')
+            if column is None:
+                column = libinput_type_column(line)
+            if line[column:column + 8] != GESTURE_TAG:
+                continue
+            event = parse_libinput_line(line, column)
+            STATS.observe('parse', time.perf_counter() - now)
+            if event:
+                yield event
     finally:
-        set_ctm(device_id, normal_ctm)
-        set_profile(device_id, initial_profile)
-        process.terminate()
+        if process.returncode is None:
+            process.terminate()
+        # Reap it while the loop is still running
+        await process.wait()
+
+EASINGS = {
+    'linear': lambda t: t,
+    'ease-in-out': lambda t: t * t * (3 - 2 * t),
+    'ease-out': lambda t: 1 - (1 - t) ** 3,
+}
 
-def find_event_node(device_id):
+class CtmRamp:
+    # Interpolates the CTM multiplier over duration seconds at a fixed frame
+    # rate. Progress is wall-clock based, so a slow frame is dropped rather
+    # than stretching the ramp.
+    def __init__(self, duration, easing='ease-in-out', fps=60):
+        self.duration = duration
+        self.ease = EASINGS[easing]
+        self.frame = 1.0 / fps
+
+    def value(self, start_value, target, elapsed):
+        t = min(1.0, elapsed / self.duration)
+        if t >= 1.0:
+            return target, True
+        return start_value + (target - start_value) * self.ease(t), False
+
+class AsyncEngine:
+    # The reader only flips the desired state; a separate writer task applies
+    # whatever is current when it gets to run (on a worker thread, so the
+    # reader never waits for X). A BEGIN followed by END before the write
+    # starts collapses into nothing, since the shadow already matches.
+    def __init__(self, writer, params, verbose=True, ramp=None, frame_log=None):
+        self.writer = writer
+        self.params = params
+        self.verbose = verbose
+        self.ramp = ramp
+        # Optional list collecting exact (interval, write cost) per ramp frame
+        self.frame_log = frame_log
+        self.current_ctm = params.normal_ctm
+        self.busy = False
+        self.pending = 0
+        self.last_event = 0.0
+        self.wake = asyncio.Event()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    def transition(self, phase, fingers, kind):
+        rule = self.params.rules.match(kind, fingers) if phase == 'begin' else None
+        # Control updates and the writer read the state under the lock
+        with self.params.lock:
+            if rule and rule is not self.params.active_rule:
+                self.params.active_rule = rule
+            elif phase == 'end' and self.params.gesture_active:
+                self.params.active_rule = None
+            else:
+                return
+        if rule:
+            STATS.count('gestures')
+            if self.verbose:
+                print(f"Gesture Begin ({fingers}-finger {kind})")
+        elif self.verbose:
+            print("Gesture End -> Normal Sensitivity & Restore Profile")
+        STATS.count('transitions')
+        self.pending += 1
+        self.last_event = STATS.last_read
+        STATS.counters['queue_depth'] = self.pending
+        if self.pending > STATS.counters.get('queue_depth_max', 0):
+            STATS.counters['queue_depth_max'] = self.pending
+        self.wake.set()
+
+    def _apply(self, props=None):
+        with self.params.lock:
+            self.writer.write(props or self.params.current_props())
+            self.current_ctm = self._written_ctm()
+
+    def _written_ctm(self):
+        # The CTM last written by anyone (ramp frames, control updates), as
+        # the shadow knows it
+        values = getattr(self.writer, 'shadow', {}).get(CTM_PROP)
+        return values[0] if values else self.current_ctm
+
+    async def _ramp(self, loop):
+        # Profile switches on the first frame, CTM eases towards the target.
+        # A new transition (wake set) cancels the ramp; the next one starts
+        # from wherever this one got to. The target is read every frame so
+        # a control update mid-ramp is followed, not overwritten. A frame
+        # whose write ran over budget is the last but one: writes that slow
+        # can't animate, so the next frame goes straight to the target.
+        with self.params.lock:
+            state = self.params.current_props()
+            start_value = self._written_ctm()
+        start = time.perf_counter()
+        deadline = start
+        last_frame = None
+        over_budget = False
+        props = [prop for prop in state if prop[0] != CTM_PROP]
+        while True:
+            frame_start = time.perf_counter()
+            interval = frame_start - last_frame if last_frame is not None else None
+            if interval is not None:
+                STATS.observe('ramp frame interval', interval)
+            last_frame = frame_start
+            with self.params.lock:
+                target = self.params.current_props()[0][1][0]
+            if over_budget:
+                value, finished = target, True
+                STATS.count('ramps_shortened')
+            else:
+                value, finished = self.ramp.value(start_value, target, frame_start - start)
+            props.insert(0, (CTM_PROP, ctm_values(value)))
+            await loop.run_in_executor(self.executor, self._apply, props)
+            cost = time.perf_counter() - frame_start
+            props = []
+            STATS.count('ramp_frames')
+            STATS.observe('ramp frame', cost)
+            if self.frame_log is not None:
+                self.frame_log.append((interval, cost))
+            if cost > self.ramp.frame:
+                STATS.count('ramp_frames_over_budget')
+                over_budget = True
+            if finished:
+                return
+            # Frames sit on a fixed grid from the ramp start; overruns skip ahead
+            now = time.perf_counter()
+            deadline += self.ramp.frame
+            if deadline < now:
+                deadline += (now - deadline) // self.ramp.frame * self.ramp.frame + self.ramp.frame
+            try:
+                await asyncio.wait_for(self.wake.wait(), deadline - now)
+                STATS.count('ramps_cancelled')
+                return
+            except asyncio.TimeoutError:
+                pass
+
+    async def write_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self.wake.wait()
+            self.wake.clear()
+            self.busy = True
+            depth = self.pending
+            triggered = self.last_event
+            self.pending = 0
+            STATS.counters['queue_depth'] = 0
+            if depth > 1:
+                STATS.count('transitions_collapsed', depth - 1)
+            start = time.perf_counter()
+            if self.ramp:
+                await self._ramp(loop)
+            else:
+                await loop.run_in_executor(self.executor, self._apply)
+            done = time.perf_counter()
+            self.busy = False
+            STATS.observe('event to applied', done - triggered)
+            if self.verbose:
+                state = 'gesture' if self.params.gesture_active else 'normal'
+                print(f"Applied {state} state [{self.writer.name} {(done - start) * 1000:.1f} ms, "
+                      f"{depth} transition(s)]")
+
+    async def drain(self):
+        while self.busy or self.wake.is_set():
+            await asyncio.sleep(0.01)
+
+async def run_engine(events, writer, params, source, verbose=True, ramp=None, frame_log=None):
+    loop = asyncio.get_running_loop()
+    engine = AsyncEngine(writer, params, verbose, ramp, frame_log)
+    task = asyncio.current_task()
+    # Lets other threads (hotplug, signals) end the stream
+    source['close'] = lambda: loop.call_soon_threadsafe(task.cancel)
+    writer_task = loop.create_task(engine.write_loop())
     try:
-        output = subprocess.check_output(['xinput', 'list-props', str(device_id)], text=True)
-        for line in output.splitlines():
-            if 'Device Node' in line:
-                # Device Node (307):	"/dev/input/event13"
-                match = re.search(r'"([^"]+)"', line)
-                if match:
-                    return match.group(1)
-    except:
+        async for phase, fingers, kind, stamp in events:
+            HISTORY.observe(phase, fingers, kind, stamp)
+            engine.transition(phase, fingers, kind)
+        await engine.drain()
+    except asyncio.CancelledError:
         pass
-    return None
+    finally:
+        source['close'] = None
+        writer_task.cancel()
+        engine.executor.shutdown(wait=True)
+
+async def async_replay_events(stream):
+    # ReplayStream timing, but sleeping on the event loop
+    loop = asyncio.get_running_loop()
+    tracker = EvdevGestureTracker()
+    column = libinput_type_column(stream.records[0][1]) if stream.records else LIBINPUT_TYPE_COLUMN
+    start = loop.time()
+    for offset, payload in stream.records:
+        if stream.speed > 0:
+            delay = start + offset / stream.speed - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        STATS.last_read = time.perf_counter()
+        if stream.kind == RECORD_EVDEV:
+            found = parse_evdev(tracker, payload[:len(payload) - len(payload) % EVENT_SIZE])
+        else:
+            event = parse_libinput_line(payload, column)
+            found = [event] if event else []
+        for event in found:
+            yield event
+
+async def bench_ramp(path, speed, writer, params, ramp):
+    # Replays a recording through the async engine with ramping enabled and
+    # samples CPU every 100 ms to catch spikes
+    stream = ReplayStream(path, speed)
+    samples = []
+
+    async def sample_cpu():
+        last = time.process_time()
+        while True:
+            await asyncio.sleep(0.1)
+            now = time.process_time()
+            samples.append((now - last) * 1000)
+            last = now
+
+    frames = []
+    sampler = asyncio.get_running_loop().create_task(sample_cpu())
+    cpu_start = time.process_time()
+    await run_engine(async_replay_events(stream), writer, params, {}, False, ramp, frames)
+    cpu = time.process_time() - cpu_start
+    sampler.cancel()
+
+    intervals = [interval * 1000 for interval, _ in frames if interval is not None]
+    costs = [cost * 1000 for _, cost in frames]
+    print(f"Ramp: {ramp.duration * 1000:.0f} ms, target frame {ramp.frame * 1000:.2f} ms")
+    print(f"Frames: {len(frames)}, over budget: {sum(1 for c in costs if c > ramp.frame * 1000)}, "
+          f"cancelled ramps: {STATS.counters.get('ramps_cancelled', 0)}")
+    print(f"Frame interval: {format_latency(intervals)}")
+    print(f"Frame write: {format_latency(costs)}")
+    print(f"CPU: {cpu * 1000:.1f} ms total, {cpu * 1e6 / max(len(frames), 1):.0f} us/frame, "
+          f"per 100 ms window: {format_latency(samples)}")
+
+# Software scaling: grab the touchpad and re-emit its events through a
+# uinput device with finger motion scaled in-process, so no X property
+# needs to change at gesture boundaries
+EV_MSC = 0x04
+ABS_Y = 0x01
+ABS_MT_POSITION_Y = 0x36
+BTN_TOUCH = 0x14a
+SCALED_AXES = (ABS_X, ABS_Y, ABS_MT_POSITION_X, ABS_MT_POSITION_Y)
+ABSINFO = struct.Struct('6i')
+
+def _ioc(direction, kind, nr, size):
+    return (direction << 30) | (size << 16) | (ord(kind) << 8) | nr
+
+EVIOCGRAB = _ioc(1, 'E', 0x90, 4)
+UI_DEV_CREATE = _ioc(0, 'U', 1, 0)
+UI_DEV_DESTROY = _ioc(0, 'U', 2, 0)
+UI_DEV_SETUP = _ioc(1, 'U', 3, 92)
+UI_ABS_SETUP = _ioc(1, 'U', 4, 28)
+# UI_SET_*BIT per event type, and the size of its EVIOCGBIT mask
+UI_SET_BITS = {
+    EV_KEY: (_ioc(1, 'U', 101, 4), 0x300 // 8),
+    EV_ABS: (_ioc(1, 'U', 103, 4), 0x40 // 8),
+    EV_MSC: (_ioc(1, 'U', 105, 4), 1),
+}
+UI_SET_EVBIT = _ioc(1, 'U', 100, 4)
+UI_SET_PROPBIT = _ioc(1, 'U', 110, 4)
+
+def ioctl_bits(fd, request, size):
+    mask = fcntl.ioctl(fd, request, bytes(size))
+    return [i for i in range(size * 8) if mask[i // 8] & (1 << (i % 8))]
+
+def read_absinfo(fd):
+    # {code: (value, min, max, fuzz, flat, resolution)} via EVIOCGABS
+    info = {}
+    for code in ioctl_bits(fd, _ioc(2, 'E', 0x20 + EV_ABS, UI_SET_BITS[EV_ABS][1]), UI_SET_BITS[EV_ABS][1]):
+        info[code] = ABSINFO.unpack(fcntl.ioctl(fd, _ioc(2, 'E', 0x40 + code, ABSINFO.size), bytes(ABSINFO.size)))
+    return info
+
+class UinputSink:
+    # A virtual copy of the source device: same event types, codes, axis
+    # ranges and input properties
+    name = 'uinput'
+
+    def __init__(self, source_fd, absinfo, device_name):
+        self.fd = os.open('/dev/uinput', os.O_WRONLY | os.O_NONBLOCK)
+        try:
+            for ev_type in ioctl_bits(source_fd, _ioc(2, 'E', 0x20, 4), 4):
+                if ev_type not in UI_SET_BITS:
+                    continue
+                fcntl.ioctl(self.fd, UI_SET_EVBIT, ev_type)
+                request, size = UI_SET_BITS[ev_type]
+                for code in ioctl_bits(source_fd, _ioc(2, 'E', 0x20 + ev_type, size), size):
+                    fcntl.ioctl(self.fd, request, code)
+            for prop in ioctl_bits(source_fd, _ioc(2, 'E', 0x09, 4), 4):
+                fcntl.ioctl(self.fd, UI_SET_PROPBIT, prop)
+            for code, info in absinfo.items():
+                fcntl.ioctl(self.fd, UI_ABS_SETUP, struct.pack('HH', code, 0) + ABSINFO.pack(*info))
+            _, vendor, product, version = struct.unpack(
+                '4H', fcntl.ioctl(source_fd, _ioc(2, 'E', 0x02, 8), bytes(8)))
+            name = f"{device_name or 'Touchpad'} (scaled)".encode()[:79]
+            # Virtual bus, so neither the daemon nor the tuner mistakes it for the touchpad
+            fcntl.ioctl(self.fd, UI_DEV_SETUP, struct.pack('4H80sI', BUS_VIRTUAL, vendor, product, version, name, 0))
+            fcntl.ioctl(self.fd, UI_DEV_CREATE)
+        except OSError:
+            os.close(self.fd)
+            raise
+
+    def write(self, data):
+        os.write(self.fd, data)
+
+    def close(self):
+        try:
+            fcntl.ioctl(self.fd, UI_DEV_DESTROY)
+        finally:
+            os.close(self.fd)
+
+class FileSink:
+    # Raw input_event stream, readable by --bench-input and --bench-uinput
+    name = 'file'
+
+    def __init__(self, path):
+        self.out = open(path, 'wb')
+
+    def write(self, data):
+        self.out.write(data)
+
+    def close(self):
+        self.out.close()
+
+class ScalingPipeline:
+    # Buffers one evdev frame, then rewrites its position axes so each
+    # contact moves by (raw delta * scale), the scale following the finger
+    # count like the CTM would: normal_ctm, or the matching swipe rule.
+    # Positions are kept as floats so slow motion isn't rounded away.
+    def __init__(self, params, sink, absinfo=None):
+        self.params = params
+        self.sink = sink
+        self.limits = {code: (info[1], info[2]) for code, info in (absinfo or {}).items()}
+        self.tracker = EvdevGestureTracker()
+        self.frame = []
+        self.slot = 0
+        # (slot, axis) -> (last raw value, last emitted value); slot is
+        # None for the single-touch axes
+        self.positions = {}
+
+    def scale_for(self, fingers):
+        params = self.params
+        rule = params.rules.match('swipe', fingers)
+        if rule is None:
+            return params.normal_ctm
+        return rule['ctm'] if rule['ctm'] is not None else params.gesture_ctm
+
+    def feed(self, data):
+        found = []
+        for event in struct.iter_unpack(EVENT_FORMAT, data):
+            transition = self.tracker.feed(event[2], event[3], event[4], event[0] + event[1] * 1e-6)
+            if transition:
+                found.append(transition)
+            self.frame.append(list(event))
+            if event[2] == EV_SYN and event[3] == SYN_REPORT:
+                self._emit()
+        return found
+
+    def _emit(self):
+        tracker = self.tracker
+        scale = self.scale_for(max(len(tracker.slots), tracker.tool_fingers))
+        positions = self.positions
+        slot = self.slot
+        for event in self.frame:
+            ev_type, code, value = event[2], event[3], event[4]
+            if ev_type == EV_ABS:
+                if code == ABS_MT_SLOT:
+                    slot = value
+                elif code == ABS_MT_TRACKING_ID:
+                    # A new contact starts where it really is
+                    positions.pop((slot, ABS_MT_POSITION_X), None)
+                    positions.pop((slot, ABS_MT_POSITION_Y), None)
+                elif code in SCALED_AXES:
+                    key = (slot if code >= ABS_MT_POSITION_X else None, code)
+                    last = positions.get(key)
+                    if last is None:
+                        virtual = value
+                    else:
+                        virtual = last[1] + (value - last[0]) * scale
+                        limits = self.limits.get(code)
+                        if limits:
+                            virtual = min(max(virtual, limits[0]), limits[1])
+                    positions[key] = (value, virtual)
+                    event[4] = int(round(virtual))
+            elif ev_type == EV_KEY and code == BTN_TOUCH and value == 1:
+                positions.pop((None, ABS_X), None)
+                positions.pop((None, ABS_Y), None)
+        self.slot = slot
+        self.sink.write(b''.join(struct.pack(EVENT_FORMAT, *event) for event in self.frame))
+        self.frame = []
+
+def run_scaling(event_node, params, source, device_name=None, sink_path=None, verbose=True):
+    # Returns when the device goes away or source['close'] is called (from
+    # any thread: closing the fd wouldn't interrupt a blocking read, so the
+    # loop waits on the device and a wake pipe)
+    fd = os.open(event_node, os.O_RDONLY | os.O_NONBLOCK)
+    wake_r, wake_w = os.pipe()
+    lock = threading.Lock()
+    wake = {'fd': wake_w}
+
+    def close():
+        with lock:
+            if wake['fd'] is not None:
+                os.write(wake['fd'], b'\0')
+
+    source['close'] = close
+    selector = selectors.DefaultSelector()
+    sink = None
+    try:
+        absinfo = read_absinfo(fd)
+        if sink_path:
+            sink = FileSink(sink_path)
+        else:
+            sink = UinputSink(fd, absinfo, device_name)
+            # Only the virtual device reaches X from now on
+            fcntl.ioctl(fd, EVIOCGRAB, 1)
+        selector.register(fd, selectors.EVENT_READ)
+        selector.register(wake_r, selectors.EVENT_READ)
+    except OSError:
+        if sink:
+            sink.close()
+        with lock:
+            wake['fd'] = None
+        for f in (fd, wake_r, wake_w):
+            os.close(f)
+        selector.close()
+        raise
+    pipeline = ScalingPipeline(params, sink, absinfo)
+    try:
+        while True:
+            ready = selector.select()
+            if any(key.fd == wake_r for key, _ in ready):
+                return
+            try:
+                data = os.read(fd, EVENT_SIZE * 64)
+            except BlockingIOError:
+                continue
+            except OSError:
+                return
+            if not data:
+                return
+            now = time.perf_counter()
+            STATS.last_read = now
+            STATS.count('events', len(data) // EVENT_SIZE)
+            for phase, fingers, kind, stamp in pipeline.feed(data):
+                HISTORY.observe(phase, fingers, kind, stamp)
+                if phase == 'begin':
+                    STATS.count('gestures')
+                STATS.count('transitions')
+                if verbose:
+                    print(f"Gesture {phase.title()} ({fingers} fingers) -> scale {pipeline.scale_for(fingers):.2f}")
+            STATS.observe('scale', time.perf_counter() - now)
+    finally:
+        sink.close()
+        selector.close()
+        with lock:
+            wake['fd'] = None
+        # Closing the fd also releases the grab
+        for f in (fd, wake_r, wake_w):
+            os.close(f)
+
+def evdev_frames(data):
+    # Splits a raw capture into whole SYN_REPORT frames
+    frames = []
+    start = 0
+    for offset in range(0, len(data) - EVENT_SIZE + 1, EVENT_SIZE):
+        _sec, _usec, ev_type, code, _value = struct.unpack_from(EVENT_FORMAT, data, offset)
+        if ev_type == EV_SYN and code == SYN_REPORT:
+            frames.append(data[start:offset + EVENT_SIZE])
+            start = offset + EVENT_SIZE
+    return frames
+
+def bench_uinput(evdev_path, params, sink_path=None):
+    # Latency the scaling pipeline adds per frame, compared with only
+    # tracking gestures on the same frames (what the property mode does)
+    with open(evdev_path, 'rb') as f:
+        frames = evdev_frames(f.read())
+    events = sum(len(frame) for frame in frames) // EVENT_SIZE
+
+    tracker = EvdevGestureTracker()
+    baseline = []
+    for frame in frames:
+        start = time.perf_counter()
+        parse_evdev(tracker, frame)
+        baseline.append((time.perf_counter() - start) * 1e6)
+
+    sink = FileSink(sink_path or os.devnull)
+    pipeline = ScalingPipeline(params, sink)
+    scaled = []
+    try:
+        for frame in frames:
+            start = time.perf_counter()
+            pipeline.feed(frame)
+            scaled.append((time.perf_counter() - start) * 1e6)
+    finally:
+        sink.close()
+
+    added = (sum(scaled) - sum(baseline)) / max(events, 1)
+    print(f"{len(frames)} frames, {events} events from {evdev_path}")
+    print(f"Gesture tracking only: {format_latency(baseline, 'us')}")
+    print(f"Scale + {sink.name} sink:   {format_latency(scaled, 'us')}")
+    print(f"Added latency: {added:.2f} us/event")
+
+# Auto-tuning from recorded traces. numpy is only needed here, so it is
+# imported on use.
+NUMBER = rb'([-+]?\d+(?:\.\d+)?)'
+MOTION_RE = re.compile(rb'POINTER_MOTION\s+\+' + NUMBER + rb's\s+' + NUMBER + rb'/\s*' + NUMBER +
+                       rb'\s+\(\s*' + NUMBER + rb'/\s*' + NUMBER + rb'(?: unaccelerated)?\)')
+SWIPE_RE = re.compile(rb'GESTURE_SWIPE_(BEGIN|UPDATE|END)\s+\+' + NUMBER + rb's\s+(\d+)(?:\s+' + NUMBER +
+                      rb'/\s*' + NUMBER + rb'\s+\(\s*' + NUMBER + rb'/\s*' + NUMBER + rb' unaccelerated\))?')
+SCROLL_RE = re.compile(rb'POINTER_(?:SCROLL_FINGER|AXIS)\s+\+' + NUMBER + rb's\s+vert\s+' + NUMBER +
+                       rb'/\S*\s+horiz\s+' + NUMBER + rb'/\S*\s+\(finger\)')
+# Pauses that end a pointer stroke / scroll sequence
+STROKE_GAP = 0.1
+SCROLL_GAP = 0.2
+TRACE_CHUNK = 8 << 20
+
+def trace_chunks(path, chunk_size=TRACE_CHUNK):
+    # Whole lines, about chunk_size bytes at a time, from a --record file
+    # (libinput kind) or a plain `libinput debug-events` log
+    with open(path, 'rb') as f:
+        head = f.read(2)
+    if head == b'\x1f\x8b':
+        with gzip.open(path, 'rb') as f:
+            if f.read(len(RECORD_MAGIC) + 1) != RECORD_MAGIC + RECORD_LIBINPUT:
+                raise ValueError(f"{path} is not a libinput recording")
+            parts, size = [], 0
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    break
+                payload = f.read(RECORD_HEADER.unpack(header)[1])
+                parts.append(payload)
+                size += len(payload)
+                if size >= chunk_size:
+                    yield b''.join(parts)
+                    parts, size = [], 0
+            if parts:
+                yield b''.join(parts)
+        return
+    with open(path, 'rb') as f:
+        rest = b''
+        while True:
+            block = f.read(chunk_size)
+            if not block:
+                if rest:
+                    yield rest
+                return
+            block = rest + block
+            cut = block.rfind(b'\n') + 1
+            rest = block[cut:]
+            yield block[:cut]
+
+class SegmentTotals:
+    # Sums a per-event value over segments (strokes, gestures) that may
+    # span chunks, binning each finished segment into a fixed histogram
+    def __init__(self, np, edges):
+        self.np = np
+        self.edges = edges
+        self.counts = np.zeros(len(edges) - 1, dtype=np.int64)
+        self.open = 0.0
+
+    def add(self, starts, values):
+        np = self.np
+        if not len(values):
+            return
+        seg = np.cumsum(starts)
+        totals = np.bincount(seg, weights=values, minlength=seg[-1] + 1)
+        totals[0] += self.open
+        self.open = totals[-1]
+        self._bin(totals[:-1])
+
+    def finish(self):
+        self._bin(self.np.array([self.open]))
+        self.open = 0.0
+
+    def _bin(self, totals):
+        totals = totals[totals > 0]
+        self.counts += self.np.histogram(totals, self.edges)[0]
 
-def get_event_node_id(device_id):
-    # Helper not used if find_event_node works
-    pass
+def histogram_percentile(np, counts, edges, pct):
+    total = counts.sum()
+    if not total:
+        return None
+    i = int(np.searchsorted(np.cumsum(counts), total * pct / 100.0))
+    # Geometric middle of the log-spaced bin
+    return float(np.sqrt(edges[i] * edges[i + 1]))
+
+def autotune(paths, target_travel=400.0, target_gesture_travel=150.0, target_scroll_steps=5.0):
+    try:
+        import numpy as np
+    except ImportError:
+        print("Auto-tuning needs numpy (pip install numpy)", file=sys.stderr)
+        return None
+    edges = np.logspace(-1, 5, 241)
+    velocity = np.zeros(len(edges) - 1, dtype=np.int64)
+    strokes = SegmentTotals(np, edges)
+    swipes = SegmentTotals(np, edges)
+    scrolls = SegmentTotals(np, edges)
+    events = 0
+    start = time.perf_counter()
+
+    for path in paths:
+        # Timestamps restart with every trace
+        last_motion = last_scroll = None
+        for chunk in trace_chunks(path):
+            motion = MOTION_RE.findall(chunk)
+            if motion:
+                m = np.array(motion, dtype='S16').astype(np.float64)
+                # Accelerated dx/dy: that is what the CTM scales
+                t, dist = m[:, 0], np.hypot(m[:, 1], m[:, 2])
+                dt = np.diff(t, prepend=t[0] if last_motion is None else last_motion)
+                # Two events in the same ms are still one stroke
+                moving = (dt >= 0) & (dt < STROKE_GAP)
+                timed = moving & (dt > 0)
+                velocity += np.histogram(dist[timed] / dt[timed], edges)[0]
+                strokes.add(~moving, dist)
+                last_motion = t[-1]
+                events += len(m)
+
+            swipe = SWIPE_RE.findall(chunk)
+            if swipe:
+                phase = np.array([row[0] for row in swipe])
+                s_ = np.array([row[1:] for row in swipe], dtype='S16')
+                s_[s_ == b''] = b'0'
+                s_ = s_.astype(np.float64)
+                fingers = s_[:, 1]
+                # Only 3+ finger swipes are the daemon's gestures
+                update = (phase == b'UPDATE') & (fingers >= GESTURE_MIN_FINGERS)
+                swipes.add(phase == b'BEGIN', np.where(update, np.hypot(s_[:, 4], s_[:, 5]), 0.0))
+                events += len(s_)
+
+            scroll = SCROLL_RE.findall(chunk)
+            if scroll:
+                c = np.array(scroll, dtype='S16').astype(np.float64)
+                t = c[:, 0]
+                dt = np.diff(t, prepend=t[0] if last_scroll is None else last_scroll)
+                scrolls.add(dt >= SCROLL_GAP, np.hypot(c[:, 1], c[:, 2]))
+                last_scroll = t[-1]
+                events += len(c)
+        strokes.finish()
+        swipes.finish()
+        scrolls.finish()
+    elapsed = time.perf_counter() - start
+
+    def pct(counts, p):
+        value = histogram_percentile(np, counts, edges, p)
+        return round(value, 1) if value is not None else None
+
+    stroke_median = pct(strokes.counts, 50)
+    swipe_median = pct(swipes.counts, 50)
+    scroll_median = pct(scrolls.counts, 50)
+    result = {
+        'events': events,
+        'seconds': round(elapsed, 3),
+        'velocity_px_s': {f"p{p}": pct(velocity, p) for p in (50, 90, 99)},
+        'stroke_travel_px': {f"p{p}": pct(strokes.counts, p) for p in (50, 90)},
+        'gesture_travel_px': {f"p{p}": pct(swipes.counts, p) for p in (50, 90)},
+        'scroll_travel_px': {f"p{p}": pct(scrolls.counts, p) for p in (50, 90)},
+        'strokes': int(strokes.counts.sum()),
+        'gestures': int(swipes.counts.sum()),
+        'scrolls': int(scrolls.counts.sum()),
+        # Clamped to the tuner's slider ranges
+        'normal_ctm': round(min(max(target_travel / stroke_median, 0.1), 3.0), 2) if stroke_median else None,
+        'gesture_ctm': round(min(max(target_gesture_travel / swipe_median, 0.1), 2.0), 2) if swipe_median else None,
+        'scroll_dist': int(min(max(scroll_median / target_scroll_steps, 10), 80)) if scroll_median else None,
+    }
+    print(json.dumps(result, indent=2))
+    return result
+
+def default_control_path():
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR') or '/tmp'
+    return os.path.join(runtime_dir, 'popos_multitouch_tuner', 'daemon.sock')
+
+CONTROL_FIELDS = {
+    'normal': float,
+    'gesture': float,
+    'profile': str,
+    'scroll_dist': int,
+}
+
+def parse_control(message):
+    # Converts every field first, so a bad one rejects the whole message
+    # before anything has changed
+    values = {}
+    for field, convert in CONTROL_FIELDS.items():
+        if field in message:
+            values[field] = convert(message[field])
+    if values.get('profile', 'flat') not in ('adaptive', 'flat', 'custom'):
+        raise ValueError(f"unknown profile {values['profile']!r}")
+    return values
+
+def handle_control(message, writer, params):
+    # {"normal": 1.2, "gesture": 0.5, "profile": "flat", "scroll_dist": 30} updates the
+    # settings in place and re-applies whichever state is active;
+    # {"cmd": "stats"} returns STATS
+    if message.get('cmd') == 'stats':
+        return {'ok': True, 'stats': STATS.snapshot()}
+    values = parse_control(message)
+    with params.lock:
+        if 'normal' in values:
+            params.normal_ctm = values['normal']
+        if 'gesture' in values:
+            params.gesture_ctm = values['gesture']
+        if 'profile' in values:
+            params.initial_profile = values['profile']
+        if 'scroll_dist' in values:
+            # Restored after gestures when a rule changes the scroll distance
+            params.initial_scroll = values['scroll_dist']
+        writer.write(params.current_props())
+        STATS.count('reconfigures')
+        return {'ok': True, 'normal': params.normal_ctm, 'gesture': params.gesture_ctm,
+                'gesture_active': params.gesture_active}
+
+def start_control_server(path, writer, params):
+    # Line-delimited JSON over a Unix socket, one reply line per request
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.exists(path):
+        os.unlink(path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    os.chmod(path, 0o600)
+    server.listen(4)
+
+    def serve(conn):
+        with conn, conn.makefile('rw') as f:
+            for line in f:
+                try:
+                    reply = handle_control(json.loads(line), writer, params)
+                except Exception as e:
+                    STATS.count('errors')
+                    reply = {'ok': False, 'error': str(e)}
+                f.write(json.dumps(reply) + '\n')
+                f.flush()
+
+    def loop():
+        while True:
+            try:
+                conn, _ = server.accept()
+            except OSError:
+                return
+            threading.Thread(target=serve, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=loop, daemon=True).start()
+    return server
+
+class GestureEngine:
+    # The gesture daemon as a library. start() sets the device up and runs
+    # the (supervised) event loop on a background thread, update() takes
+    # the same messages as the control socket, stop() ends the stream and
+    # waits for the normal properties to be restored. main() drives one of
+    # these in the foreground.
+    def __init__(self, device_id, normal=1.0, gesture=0.4, backend='auto', input_mode='auto',
+                 engine='async', rules_path=CONFIG_PATH, event_node=None, source_cmd=None,
+                 record=None, uinput_sink=None, ramp=None, supervise=True, min_backoff=0.5,
+                 max_backoff=30.0, stats_file='', stats_interval=2.0, history_file='',
+                 history_interval=60.0, control_socket='', on_ready=None, on_exit=None):
+        self.device_id = device_id
+        self.normal = normal
+        self.gesture = gesture
+        self.backend = backend
+        self.input_mode = input_mode
+        self.engine = engine
+        self.rules_path = rules_path
+        self.event_node = event_node
+        self.source_cmd = source_cmd
+        self.record = record
+        self.uinput_sink = uinput_sink
+        self.ramp = ramp
+        self.supervise = supervise
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.stats_file = stats_file
+        self.stats_interval = stats_interval
+        self.history_file = history_file
+        self.history_interval = history_interval
+        self.control_socket = control_socket
+        # on_ready(engine) each time monitoring (re)starts, on_exit(engine, code)
+        # once the thread ends; both run on the engine thread
+        self.on_ready = on_ready
+        self.on_exit = on_exit
+        self.writer = None
+        self.params = None
+        self.pending = {}
+        self.lock = threading.Lock()
+        # The current source; replaced by the supervisor on reconnect
+        self.source = {'node': None, 'close': None}
+        self.device_name = None
+        self.registry = None
+        self.monitor = None
+        self.control = None
+        self.stopping = threading.Event()
+        self.closed = False
+        self.thread = None
+
+    def setup(self):
+        print(f"Starting Gesture Daemon for Device {self.device_id}")
+        print(f"Normal CTM: {self.normal}, Gesture CTM: {self.gesture}")
+
+        # Capture initial profile to restore later; one list-props read seeds
+        # the profile, the event node and the shadow of the managed properties
+        device_props = list_props(self.device_id) if self.device_id else {}
+        initial_profile = get_current_profile(self.device_id, device_props)
+        print(f"Initial Profile: {initial_profile}")
+
+        self.writer = ShadowWriter(make_writer(self.device_id, self.backend),
+                                   {prop: device_props[prop] for prop in (CTM_PROP, PROFILE_PROP)
+                                    if prop in device_props})
+        print(f"Property backend: {self.writer.name}")
+        scroll = device_props.get(SCROLL_PROP)
+        params = GestureParams(self.normal, self.gesture, initial_profile, load_rules(self.rules_path),
+                               int(scroll[0]) if scroll else None)
+
+        # Ensure we start with normal CTM and initial profile
+        self.writer.write(params.normal_props())
+
+        if self.input_mode == 'auto' and params.rules.needs_libinput and self.engine != 'uinput':
+            print("Pinch/hold rules need libinput debug-events input")
+            self.input_mode = 'libinput'
+
+        event_node = self.event_node or find_event_node(self.device_id, device_props)
+        if not event_node:
+            self.writer.close()
+            raise RuntimeError("Could not find event node for device.")
+        self.source['node'] = event_node
+
+        # Updates that arrived while starting up
+        with self.lock:
+            self.params = params
+            pending, self.pending = self.pending, {}
+        if pending:
+            handle_control(pending, self.writer, params)
+
+        self.registry = DeviceRegistry()
+        self.registry.scan()
+        device = self.registry.devices.get(event_node)
+        self.device_name = device.name if device else None
+        self.registry.subscribe(self._on_device_change)
+        try:
+            self.monitor = self.registry.start_monitor()
+        except OSError as e:
+            print(f"Hotplug monitoring unavailable: {e}", file=sys.stderr)
+
+        if self.stats_file:
+            start_stats_writer(self.stats_file, self.stats_interval, self.stopping)
+            print(f"Writing stats to {self.stats_file}")
+        if self.history_file:
+            start_history_writer(self.history_file, self.history_interval, self.stopping)
+
+        if self.control_socket:
+            try:
+                self.control = start_control_server(self.control_socket, self.writer, params)
+                print(f"Listening for control messages on {self.control_socket}")
+            except OSError as e:
+                print(f"Error starting control socket: {e}", file=sys.stderr)
+
+    def _on_device_change(self, action, device):
+        # End the stream (restoring properties) if the touchpad is unplugged
+        if action == 'remove' and device.node == self.source['node'] and self.source['close']:
+            print(f"Device {device.node} removed.", file=sys.stderr)
+            self.source['close']()
+
+    def resolve(self):
+        # Find the touchpad again after a reset/replug: its event node and X ID may both change
+        if self.event_node:
+            return self.event_node
+        if self.device_name:
+            self.registry.scan()
+            self.registry.invalidate_xids()
+            for node, device in self.registry.devices.items():
+                if device.name == self.device_name:
+                    xid = self.registry.xid_for(device)
+                    if xid and xid != self.device_id:
+                        print(f"Touchpad is now X device {xid}")
+                        self.device_id = xid
+                        self.writer.retarget(make_writer(self.device_id, self.backend))
+                    return node
+            return None
+        return find_event_node(self.device_id)
+
+    def update(self, **message):
+        # Same messages as the control socket; held until setup is done
+        with self.lock:
+            if self.params is None:
+                # Rejected now rather than when setup applies it
+                parse_control(message)
+                self.pending.update(message)
+                return {'ok': True, 'pending': True}
+        return handle_control(message, self.writer, self.params)
+
+    def run(self):
+        # Blocks until the stream ends (without supervise) or stop()
+        source = self.source
+        params = self.params
+        writer = self.writer
+        backoff = self.min_backoff
+        try:
+            while not self.stopping.is_set():
+                print(f"Monitoring {source['node']}...")
+                if self.on_ready:
+                    self.on_ready(self)
+                started = time.monotonic()
+                try:
+                    if self.engine == 'uinput':
+                        run_scaling(source['node'], params, source, self.device_name, self.uinput_sink)
+                    elif self.engine == 'async' and not self.record:
+                        asyncio.run(run_engine(async_event_source(source['node'], self.input_mode,
+                                                                  self.source_cmd),
+                                               writer, params, source, ramp=self.ramp))
+                    else:
+                        # Only the first session is recorded
+                        events, source['close'] = open_event_source(
+                            source['node'], self.input_mode,
+                            self.record if not STATS.counters['restarts'] else None, self.source_cmd)
+                        run_loop(events, writer, params)
+                except Exception as e:
+                    STATS.count('errors')
+                    print(f"Error in loop: {e}", file=sys.stderr)
+                finally:
+                    if source['close']:
+                        source['close']()
+
+                if not self.supervise or self.stopping.is_set():
+                    break
+
+                # Stream lost: keep the pointer usable while we reconnect
+                lost = time.monotonic()
+                with params.lock:
+                    params.active_rule = None
+                    writer.write(params.normal_props())
+                if lost - started > self.max_backoff:
+                    backoff = self.min_backoff
+                print("Event stream ended, reconnecting...", file=sys.stderr)
+                node = None
+                while not self.stopping.wait(backoff):
+                    backoff = min(backoff * 2, self.max_backoff)
+                    node = self.resolve()
+                    if node:
+                        break
+                    print(f"Touchpad not found, retrying in {backoff:.1f}s", file=sys.stderr)
+                if not node:
+                    break
+                source['node'] = node
+                # A reset or resumed device comes back with driver defaults,
+                # usually under the same X ID, so the shadow can't be trusted
+                with params.lock:
+                    writer.shadow.clear()
+                    writer.write(params.normal_props())
+                downtime = time.monotonic() - lost
+                STATS.count('restarts')
+                STATS.count('downtime_ms', int(downtime * 1000))
+                STATS.observe('downtime', downtime)
+                print(f"Reconnecting after {downtime:.1f}s (restart #{STATS.counters['restarts']})")
+        finally:
+            self.shutdown()
+            print(f"Property writes: {writer.writes}, avoided: {writer.avoided}")
+            if STATS.counters['restarts']:
+                print(f"Restarts: {STATS.counters['restarts']}, downtime: {STATS.counters['downtime_ms'] / 1000:.1f}s")
+            if self.stats_file:
+                try:
+                    write_stats_file(self.stats_file)
+                except Exception as e:
+                    print(f"Error writing stats file: {e}", file=sys.stderr)
+
+    def shutdown(self):
+        # Restore the normal properties and release everything; runs once
+        if self.closed:
+            return
+        self.closed = True
+        self.stopping.set()
+        if self.params:
+            with self.params.lock:
+                self.writer.write(self.params.normal_props())
+                self.writer.close()
+        if self.source['close']:
+            self.source['close']()
+        if self.monitor:
+            self.monitor.close()
+        if self.history_file:
+            try:
+                flush_history(self.history_file)
+            except Exception as e:
+                print(f"Error writing gesture history: {e}", file=sys.stderr)
+        if self.control:
+            self.control.close()
+            try:
+                os.unlink(self.control_socket)
+            except OSError:
+                pass
+
+    def _main(self):
+        code = 0
+        try:
+            self.setup()
+            self.run()
+        except Exception as e:
+            print(f"Gesture engine failed: {e}", file=sys.stderr)
+            code = 1
+        if self.on_exit:
+            self.on_exit(self, code)
+
+    def start(self):
+        self.thread = threading.Thread(target=self._main, name='gesture-engine', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self, timeout=3.0):
+        # Any thread. The stream may only just be opening, so keep closing
+        # it until the loop is gone.
+        self.stopping.set()
+        deadline = time.monotonic() + timeout
+        while self.thread and self.thread.is_alive():
+            if self.source['close']:
+                self.source['close']()
+            self.thread.join(0.005)
+            if time.monotonic() > deadline:
+                print("Gesture engine did not stop in time", file=sys.stderr)
+                return False
+        return True
+
+    @property
+    def running(self):
+        return bool(self.thread and self.thread.is_alive())
+
+def bench_start(runs, engine='async'):
+    # Time from asking for an engine to it monitoring the touchpad, for a
+    # first start and for a restart (stop + start), with GestureEngine on a
+    # thread vs a fresh `gesture_daemon.py` process. Fake writer; the
+    # source is the idle bench generator, which isn't waited for.
+    source_cmd = shlex.join([sys.executable, os.path.abspath(__file__), '--bench-generate', 'idle',
+                             '--bench-seconds', '3600'])
+    common = {'backend': 'fake', 'event_node': 'bench', 'source_cmd': source_cmd, 'engine': engine,
+              'supervise': False}
+
+    def thread_start():
+        ready = threading.Event()
+        handle = GestureEngine(None, on_ready=lambda e: ready.set(), **common).start()
+        ready.wait(10)
+        return handle
+
+    def thread_stop(handle):
+        handle.stop()
+
+    def process_start():
+        handle = subprocess.Popen(
+            [sys.executable, '-u', os.path.abspath(__file__), '--backend', 'fake', '--event-node', 'bench',
+             '--source-cmd', source_cmd, '--engine', engine, '--stats-file', '', '--history-file', '',
+             '--control-socket', ''],
+            stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        for line in handle.stdout:
+            if line.startswith('Monitoring'):
+                break
+        return handle
+
+    def process_stop(handle):
+        handle.terminate()
+        handle.wait()
+        handle.stdout.close()
+
+    results = {}
+    for mode, start, stop in (('thread', thread_start, thread_stop), ('process', process_start, process_stop)):
+        starts, restarts = [], []
+        for _ in range(runs):
+            t0 = time.perf_counter()
+            handle = start()
+            starts.append((time.perf_counter() - t0) * 1000)
+            t0 = time.perf_counter()
+            stop(handle)
+            handle = start()
+            restarts.append((time.perf_counter() - t0) * 1000)
+            stop(handle)
+        print(f"{mode} start:   {format_latency(starts)}")
+        print(f"{mode} restart: {format_latency(restarts)}")
+        results[mode] = (starts, restarts)
+    return results
+
+def main(argv=None):
+    # Console entry point (gesture_daemon:main)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--device', help="Touchpad Device ID")
+    parser.add_argument('--normal', type=float, default=1.0, help="Normal CTM multiplier")
+    parser.add_argument('--gesture', type=float, default=0.4, help="Gesture (3-finger) CTM multiplier")
+    parser.add_argument('--backend', choices=['auto', 'xlib', 'xinput', 'fake'], default='auto',
+                        help="Property writer backend (xlib keeps one X connection open, fake writes nothing)")
+    parser.add_argument('--bench-writer', type=int, metavar='N',
+                        help="Measure N begin/end transitions with each backend and exit")
+    parser.add_argument('--input', choices=['auto', 'evdev', 'libinput'], default='auto',
+                        help="Read the event node directly (evdev) or parse libinput debug-events")
+    parser.add_argument('--bench-input', nargs=2, metavar=('EVDEV_DUMP', 'LIBINPUT_LOG'),
+                        help="Compare CPU per event of both input pipelines on recorded dumps and exit")
+    parser.add_argument('--record', metavar='FILE', help="Also record the event stream to FILE")
+    parser.add_argument('--replay', metavar='FILE', help="Feed a recording into the daemon loop and exit")
+    parser.add_argument('--bench-replay', metavar='FILE',
+                        help="Replay a recording quietly and report throughput and latency")
+    parser.add_argument('--speed', type=float,
+                        help="Replay speed: 1 is real time, 0 is as fast as possible")
+    parser.add_argument('--stats-file', default=default_stats_path(),
+                        help="Periodically rewritten JSON stats file ('' to disable)")
+    parser.add_argument('--stats-interval', type=float, default=2.0, help="Stats file rewrite interval (s)")
+    parser.add_argument('--history-file', default=default_history_path(),
+                        help="SQLite file for hourly gesture rollups ('' to disable)")
+    parser.add_argument('--history-interval', type=float, default=60.0,
+                        help="Gesture history flush interval (s)")
+    parser.add_argument('--control-socket', default=default_control_path(),
+                        help="Unix socket for live reconfiguration ('' to disable)")
+    parser.add_argument('--supervise', action='store_true',
+                        help="Reconnect with exponential backoff when the event stream ends")
+    parser.add_argument('--min-backoff', type=float, default=0.5, help="First reconnect delay (s)")
+    parser.add_argument('--max-backoff', type=float, default=30.0, help="Longest reconnect delay (s)")
+    parser.add_argument('--engine', choices=['async', 'sync', 'uinput'], default='async',
+                        help="async reads events and writes properties in separate tasks (--record uses sync); "
+                             "uinput grabs the touchpad and scales motion in-process through a virtual device")
+    parser.add_argument('--uinput-sink', metavar='FILE',
+                        help="With --engine uinput or --bench-uinput, write the scaled events to FILE instead")
+    parser.add_argument('--bench-uinput', metavar='EVDEV_CAPTURE',
+                        help="Measure the per-event latency the uinput scaling pipeline adds on a raw evdev capture")
+    parser.add_argument('--ramp-ms', type=float, default=0,
+                        help="Ease the CTM between states over this many ms (async engine; 0 switches at once)")
+    parser.add_argument('--ramp-easing', choices=sorted(EASINGS), default='ease-in-out')
+    parser.add_argument('--ramp-fps', type=float, default=60, help="Ramp frame rate; one frame is the write budget")
+    parser.add_argument('--bench-ramp', metavar='FILE',
+                        help="Replay a recording through the ramping engine and report frame timing and CPU")
+    parser.add_argument('--rules', default=CONFIG_PATH,
+                        help="JSON file whose 'gesture_rules' map gesture type and finger count to settings")
+    parser.add_argument('--bench-classify', metavar='LIBINPUT_LOG', nargs='?', const='',
+                        help="Compare line classification cost of the bytes fast path and the old decode + substring "
+                             "checks, on a saved libinput debug-events log or a synthetic motion-heavy stream")
+    parser.add_argument('--bench', choices=sorted(BENCH_SCENARIOS) + ['all'],
+                        help="Run the libinput pipeline against a synthetic stream and a fake sink; "
+                             "prints one JSON line per scenario")
+    parser.add_argument('--bench-rate', type=float, default=0,
+                        help="Lines/sec for --bench (default: per scenario)")
+    parser.add_argument('--bench-seconds', type=float, default=10.0,
+                        help="Duration of each --bench scenario")
+    parser.add_argument('--bench-generate', choices=sorted(BENCH_SCENARIOS), help=argparse.SUPPRESS)
+    parser.add_argument('--watch-focus', action='store_true',
+                        help="Print the focused application's WM_CLASS on every focus change")
+    parser.add_argument('--autotune', nargs='+', metavar='TRACE',
+                        help="Recommend normal/gesture multipliers and scroll distance from libinput logs or "
+                             "--record files (needs numpy)")
+    parser.add_argument('--target-travel', type=float, default=400.0,
+                        help="--autotune: pointer travel (px) wanted for a typical stroke")
+    parser.add_argument('--target-gesture-travel', type=float, default=150.0,
+                        help="--autotune: pointer travel (px) wanted for a typical 3+ finger swipe")
+    parser.add_argument('--target-scroll-steps', type=float, default=5.0,
+                        help="--autotune: scroll steps wanted for a typical two-finger scroll")
+    parser.add_argument('--event-node', help="Event node to read instead of the device's 'Device Node'")
+    parser.add_argument('--source-cmd',
+                        help="Command printing libinput-style events instead of libinput debug-events; "
+                             "{node} is replaced by the event node")
+    parser.add_argument('--apply', action='store_true',
+                        help="Apply the tuner's saved settings without the GUI and exit")
+    parser.add_argument('--daemon', action='store_true',
+                        help="With --apply, keep running as the gesture daemon if it is enabled in the config")
+    parser.add_argument('--bench-start', type=int, metavar='N',
+                        help="Compare engine start and restart latency in-process (thread) and as a subprocess, "
+                             "N runs each")
+    args = parser.parse_args(argv)
+
+    if args.apply:
+        start = time.perf_counter()
+        settings = load_settings()
+        device_id = args.device or find_touchpad_id()
+        if not device_id:
+            print("Touchpad device not found!", file=sys.stderr)
+            return 1
+        # Non-zero exit tells the autostart entry to let the tuner apply them
+        if not apply_settings(device_id, settings, args.backend):
+            print(f"Failed to apply settings to device {device_id}", file=sys.stderr)
+            return 1
+        done = time.perf_counter()
+        print(f"Settings applied to device {device_id} in {(done - start) * 1000:.1f} ms "
+              f"({(done - STARTED) * 1000:.1f} ms after startup)")
+        if not (args.daemon and settings['daemon_enabled']):
+            return
+        args.device = device_id
+        args.normal = float(settings['normal_ctm'])
+        args.gesture = float(settings['gesture_ctm'])
+        args.supervise = True
+
+    if args.bench_input:
+        bench_input(*args.bench_input)
+        return
+    if args.autotune:
+        autotune(args.autotune, args.target_travel, args.target_gesture_travel, args.target_scroll_steps)
+        return
+    if args.watch_focus:
+        watch_focus()
+        return
+    if args.bench_generate:
+        generate_stream(args.bench_generate, args.bench_rate, args.bench_seconds, sys.stdout.buffer)
+        return
+    if args.bench:
+        rules = load_rules(args.rules)
+        for scenario in (sorted(BENCH_SCENARIOS) if args.bench == 'all' else [args.bench]):
+            # Fresh params so gesture state can't carry over between scenarios
+            params = GestureParams(args.normal, args.gesture, 'adaptive', rules)
+            bench(scenario, args.bench_rate, args.bench_seconds, args.engine, params)
+        return
+    if args.bench_uinput:
+        params = GestureParams(args.normal, args.gesture, 'adaptive', load_rules(args.rules))
+        bench_uinput(args.bench_uinput, params, args.uinput_sink)
+        return
+    if args.bench_classify is not None:
+        bench_classify(args.bench_classify, load_rules(args.rules))
+        return
+    if args.bench_start:
+        bench_start(args.bench_start, args.engine)
+        return
+    replay_path = args.replay or args.bench_replay or args.bench_ramp
+    if replay_path:
+        # Writes go to a fake sink unless a real device is given
+        if args.device:
+            device_props = list_props(args.device)
+            writer = ShadowWriter(make_writer(args.device, args.backend), device_props)
+            initial_profile = get_current_profile(args.device, device_props)
+        else:
+            writer = ShadowWriter(FakeWriter())
+            initial_profile = 'adaptive'
+        speed = args.speed if args.speed is not None else (1.0 if args.replay else 0.0)
+        params = GestureParams(args.normal, args.gesture, initial_profile, load_rules(args.rules))
+        try:
+            if args.bench_ramp:
+                ramp = CtmRamp((args.ramp_ms or 150) / 1000.0, args.ramp_easing, args.ramp_fps)
+                asyncio.run(bench_ramp(replay_path, args.speed if args.speed is not None else 1.0,
+                                       writer, params, ramp))
+            else:
+                replay(replay_path, speed, writer, params, verbose=bool(args.replay))
+        finally:
+            writer.close()
+        return
+    # Without a device only a fake sink on an explicit node makes sense
+    if not args.device and not (args.backend == 'fake' and args.event_node):
+        parser.error("--device is required")
+
+    if args.bench_writer:
+        device_props = list_props(args.device)
+        bench_writers(args.device, args.normal, args.gesture, get_current_profile(args.device, device_props),
+                      args.bench_writer)
+        return
+
+    engine = GestureEngine(
+        args.device, args.normal, args.gesture, args.backend, args.input, args.engine, args.rules,
+        args.event_node, args.source_cmd, args.record, args.uinput_sink,
+        CtmRamp(args.ramp_ms / 1000.0, args.ramp_easing, args.ramp_fps) if args.ramp_ms > 0 else None,
+        args.supervise, args.min_backoff, args.max_backoff, args.stats_file, args.stats_interval,
+        args.history_file, args.history_interval, args.control_socket)
+    try:
+        engine.setup()
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    # Handle exit signals to restore CTM
+    def signal_handler(sig, frame):
+        print("\nExiting... Restoring Normal CTM and Profile.")
+        engine.shutdown()
+        sys.exit(0)
+
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
+
+    engine.run()
+
+def find_event_node(device_id, props=None):
+    if props is None:
+        props = list_props(device_id)
+    # Device Node (307):	"/dev/input/event13"
+    values = props.get('Device Node')
+    if values and isinstance(values[0], str) and values[0]:
+        return values[0]
+    return None
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
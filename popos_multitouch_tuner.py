@@ -6,9 +6,17 @@ import os
 import xml.etree.ElementTree as ET
 import sys
 import threading
+import shutil
 from PIL import Image, ImageDraw
 import pystray
 import json
+import socket
+import time
+import functools
+import concurrent.futures
+import selectors
+import collections
+import gesture_daemon
 
 TRANSLATIONS = {
     'en': {
@@ -27,7 +35,11 @@ TRANSLATIONS = {
         'error_device': "Touchpad device not found!",
         'error_config': "Error loading config: {}",
         'error_save': "Error saving config: {}",
-        'language': "Language"
+        'language': "Language",
+        'history_frame': "Gestures (last 24 h)",
+        'history_empty': "No gestures recorded yet.",
+        'daemon_exited': "Daemon Status: Exited (code {})",
+        'log_frame': "Daemon Log"
     },
     'ja': {
         'title': "Pop!_OS マルチタッチチューナー",
@@ -45,7 +57,11 @@ TRANSLATIONS = {
         'error_device': "タッチパッドが見つかりません！",
         'error_config': "設定の読み込みエラー: {}",
         'error_save': "設定の保存エラー: {}",
-        'language': "言語 (Language)"
+        'language': "言語 (Language)",
+        'history_frame': "ジェスチャー (過去24時間)",
+        'history_empty': "まだジェスチャーの記録がありません。",
+        'daemon_exited': "デーモン状態: 終了 (コード {})",
+        'log_frame': "デーモンログ"
     },
     'ko': {
         'title': "Pop!_OS 멀티터치 튜너",
@@ -63,19 +79,543 @@ TRANSLATIONS = {
         'error_device': "터치패드 장치를 찾을 수 없습니다!",
         'error_config': "설정 로드 오류: {}",
         'error_save': "설정 저장 오류: {}",
-        'language': "언어 (Language)"
+        'language': "언어 (Language)",
+        'history_frame': "제스처 (최근 24시간)",
+        'history_empty': "아직 기록된 제스처가 없습니다.",
+        'daemon_exited': "데몬 상태: 종료됨 (코드 {})",
+        'log_frame': "데몬 로그"
     }
 }
 
+CURVE_PREVIEW_SIZE = (220, 90)
+CURVE_KEYS = ('gain', 'threshold', 'accel', 'points', 'max_speed')
+
+@functools.lru_cache(maxsize=64)
+def curve_preview(curve_key):
+    # Canvas polyline coordinates for a curve; slider positions repeat a
+    # lot while dragging back and forth, so rendered curves are cached
+    curve = dict(zip(CURVE_KEYS, curve_key))
+    step, points = gesture_daemon.custom_accel_points(curve)
+    width, height = CURVE_PREVIEW_SIZE
+    top = max(points[-1], curve['max_speed'] * 3)
+    coords = []
+    for i, value in enumerate(points):
+        coords += [i * width / (len(points) - 1), height - value * height / top]
+    return tuple(coords)
+
+class ApplyScheduler:
+    # Sits between slider callbacks and the setters. Bursts are coalesced
+    # per setting: only the latest value is kept, it is applied on the
+    # trailing edge, at most once per min_interval_ms, and a setting is
+    # never applied again while its previous apply is still running.
+    def __init__(self, root, min_interval_ms=100, monitor=None):
+        self.root = root
+        self.min_interval = min_interval_ms / 1000.0
+        self.monitor = monitor
+        self.pending = {}
+        self.timers = {}
+        self.last_apply = {}
+        self.in_flight = set()
+
+    def submit(self, key, func, value):
+        self.pending[key] = (func, value)
+        self._schedule(key)
+
+    def _schedule(self, key):
+        if key in self.timers or key in self.in_flight or key not in self.pending:
+            return
+        wait = self.last_apply.get(key, 0) + self.min_interval - time.monotonic()
+        self.timers[key] = self.root.after(max(0, int(wait * 1000)), lambda: self._fire(key))
+
+    def _fire(self, key):
+        self.timers.pop(key, None)
+        if key not in self.pending:
+            return
+        func, value = self.pending.pop(key)
+        self.in_flight.add(key)
+        self.last_apply[key] = time.monotonic()
+        start = time.perf_counter()
+        try:
+            func(value)
+        except Exception as e:
+            print(f"Error applying {key}: {e}")
+        finally:
+            self.in_flight.discard(key)
+        if self.monitor:
+            self.monitor.measure(f"apply {key}", time.perf_counter() - start)
+        # A newer value arrived while applying
+        self._schedule(key)
+
+    def flush(self):
+        # Apply everything still pending right away (e.g. on exit)
+        for key, timer in list(self.timers.items()):
+            self.root.after_cancel(timer)
+            self._fire(key)
+
+class TaskRunner:
+    # Runs blocking system calls (xinput, gsettings, the daemon socket) on a
+    # small worker pool so the Tk thread never waits on a subprocess. Per
+    # key at most one task runs and only the newest waiting one is kept, so
+    # writes to one property stay in order. Results and errors come back
+    # on the Tk thread via root.after; UI-thread callbacks are timed
+    # against budget_ms and overruns are reported.
+    def __init__(self, root, workers=2, budget_ms=16):
+        self.root = root
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers,
+                                                              thread_name_prefix='tuner')
+        self.budget = budget_ms / 1000.0
+        self.running = set()
+        self.waiting = {}
+        self.stats = {'tasks': 0, 'replaced': 0, 'errors': 0, 'callbacks': 0,
+                      'over_budget': 0, 'max_callback_ms': 0.0, 'max_task_ms': 0.0,
+                      'max_wait_ms': 0.0}
+
+    def submit(self, key, func, *args, on_done=None, on_error=None):
+        # Tk thread only
+        if key in self.waiting:
+            self.stats['replaced'] += 1
+        self.waiting[key] = (func, args, on_done, on_error, time.perf_counter())
+        self._dispatch(key)
+
+    def _dispatch(self, key):
+        if key in self.running or key not in self.waiting:
+            return
+        func, args, on_done, on_error, queued = self.waiting.pop(key)
+        self.running.add(key)
+        self.stats['tasks'] += 1
+
+        def work():
+            start = time.perf_counter()
+            try:
+                result, error = func(*args), None
+            except Exception as e:
+                result, error = None, e
+            done = time.perf_counter()
+            try:
+                self.root.after(0, self._finish, key, on_done, on_error, result, error,
+                                start - queued, done - start)
+            except (RuntimeError, tk.TclError):
+                pass # Tk is gone
+
+        self.executor.submit(work)
+
+    def _finish(self, key, on_done, on_error, result, error, waited, elapsed):
+        self.running.discard(key)
+        self.stats['max_wait_ms'] = max(self.stats['max_wait_ms'], waited * 1000)
+        self.stats['max_task_ms'] = max(self.stats['max_task_ms'], elapsed * 1000)
+        if error is not None:
+            self.stats['errors'] += 1
+        callback = on_error if error is not None else on_done
+        if callback:
+            start = time.perf_counter()
+            try:
+                callback(error if error is not None else result)
+            except Exception as e:
+                print(f"Error handling {key} result: {e}")
+            self.measure(key, time.perf_counter() - start)
+        elif error is not None:
+            print(f"Error in {key}: {error}")
+        # A newer task for this key arrived while this one ran
+        self._dispatch(key)
+
+    def measure(self, name, seconds):
+        self.stats['callbacks'] += 1
+        self.stats['max_callback_ms'] = max(self.stats['max_callback_ms'], seconds * 1000)
+        if seconds > self.budget:
+            self.stats['over_budget'] += 1
+            print(f"UI callback {name} took {seconds * 1000:.1f} ms "
+                  f"(budget {self.budget * 1000:.0f} ms)")
+
+    def close(self, timeout=2.0):
+        # On exit: keep Tk's event loop turning (workers hand results back
+        # through it, so blocking here would deadlock) until every queued
+        # write has gone out
+        deadline = time.monotonic() + timeout
+        while self.running and time.monotonic() < deadline:
+            self.root.update()
+            time.sleep(0.005)
+        self.executor.shutdown(wait=False)
+        print("UI thread: " + ", ".join(f"{k}={v:.1f}" if isinstance(v, float) else f"{k}={v}"
+                                        for k, v in self.stats.items()))
+
+LOG_LINES = 500
+
+class LogRing:
+    # Keeps only the last `lines` lines of output (each cut to max_line
+    # chars), numbered so the log pane can ask for what it hasn't shown.
+    # on_output is called once per batch of new lines, until since() picks
+    # them up.
+    def __init__(self, on_output, lines=LOG_LINES, max_line=512):
+        self.on_output = on_output
+        self.max_line = max_line
+        self.ring = collections.deque(maxlen=lines)
+        self.seq = 0
+        self.notified = False
+        self.lock = threading.Lock()
+
+    def since(self, seq):
+        # Lines newer than seq, as (seq, stream, text)
+        with self.lock:
+            self.notified = False
+            if self.seq - seq > len(self.ring):
+                return list(self.ring)
+            return list(self.ring)[len(self.ring) - (self.seq - seq):]
+
+    def add(self, stream, lines):
+        with self.lock:
+            for line in lines:
+                self.seq += 1
+                self.ring.append((self.seq, stream, line[:self.max_line]))
+            notify = not self.notified
+            self.notified = True
+        if notify:
+            self.on_output(self)
+
+class OutputTee:
+    # Stands in for sys.stdout/sys.stderr while the engine runs in-process:
+    # everything still reaches the real stream, and whole lines also go to
+    # the ring as `name`
+    def __init__(self, stream, ring, name):
+        self.stream = stream
+        self.ring = ring
+        self.name = name
+        self.partial = ''
+        self.lock = threading.Lock()
+
+    def write(self, text):
+        self.stream.write(text)
+        with self.lock:
+            lines = (self.partial + text).split('\n')
+            self.partial = lines.pop()[:self.ring.max_line]
+        if lines:
+            self.ring.add(self.name, lines)
+        return len(text)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+class DaemonMonitor(LogRing):
+    # Drains the daemon's stdout/stderr on one thread so it never blocks on
+    # a full pipe, into the ring. A pidfd reports the exit the moment it
+    # happens; without one, EOF on both pipes does.
+    def __init__(self, process, on_output, on_exit, lines=LOG_LINES, max_line=512):
+        super().__init__(on_output, lines, max_line)
+        self.process = process
+        self.on_exit = on_exit
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def _add_bytes(self, stream, lines):
+        self.add(stream, [line[:self.max_line].decode('utf-8', 'replace') for line in lines])
+
+    def run(self):
+        sel = selectors.DefaultSelector()
+        for stream, pipe in (('out', self.process.stdout), ('err', self.process.stderr)):
+            os.set_blocking(pipe.fileno(), False)
+            sel.register(pipe, selectors.EVENT_READ, stream)
+        try:
+            pidfd = os.pidfd_open(self.process.pid)
+            sel.register(pidfd, selectors.EVENT_READ, 'exit')
+        except (AttributeError, OSError):
+            pidfd = None
+        partial = {'out': b'', 'err': b''}
+        pipes = 2
+        exited = False
+        while pipes:
+            for key, _ in sel.select():
+                if key.data == 'exit':
+                    sel.unregister(pidfd)
+                    os.close(pidfd)
+                    exited = True
+                    self.on_exit(self, self.process.wait())
+                    continue
+                data = os.read(key.fd, 65536)
+                if not data:
+                    sel.unregister(key.fileobj)
+                    pipes -= 1
+                    if partial[key.data]:
+                        self._add_bytes(key.data, [partial[key.data]])
+                    continue
+                lines = (partial[key.data] + data).split(b'\n')
+                # An endless line without newline must not grow forever
+                partial[key.data] = lines.pop()[:self.max_line]
+                self._add_bytes(key.data, lines)
+        self.process.stdout.close()
+        self.process.stderr.close()
+        if not exited:
+            if pidfd is not None:
+                os.close(pidfd)
+            self.on_exit(self, self.process.wait())
+        sel.close()
+
+class ConfigStore:
+    # Settings live in memory; changes mark the store dirty and are written
+    # from a background timer once no change has arrived for idle_delay
+    # seconds, via a temp file + atomic rename so a crash can't truncate it
+    def __init__(self, path, defaults, idle_delay=1.0):
+        self.path = path
+        self.values = dict(defaults)
+        self.idle_delay = idle_delay
+        self.dirty = False
+        self.timer = None
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.load_time = 0.0
+        self.save_time = 0.0
+        self.saves = 0
+
+    def load(self):
+        start = time.perf_counter()
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                self.values.update(json.load(f))
+        self.load_time = time.perf_counter() - start
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def update(self, **values):
+        with self.lock:
+            changed = {k: v for k, v in values.items() if self.values.get(k) != v}
+            if not changed:
+                return
+            self.values.update(changed)
+            self.dirty = True
+            if self.timer:
+                self.timer.cancel()
+            self.timer = threading.Timer(self.idle_delay, self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush(self):
+        with self.lock:
+            if self.timer:
+                self.timer.cancel()
+                self.timer = None
+            if not self.dirty:
+                return False
+            snapshot = dict(self.values)
+            self.dirty = False
+
+        with self.write_lock:
+            start = time.perf_counter()
+            tmp_path = self.path + '.tmp'
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with open(tmp_path, 'w') as f:
+                    json.dump(snapshot, f, indent=4)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+            except Exception as e:
+                print(f"Error saving config: {e}")
+                with self.lock:
+                    self.dirty = True
+                return False
+            self.save_time = time.perf_counter() - start
+            self.saves += 1
+        print(f"Config saved ({self.save_time * 1000:.1f} ms).")
+        return True
+
+class TouchEggConfig:
+    # Keeps touchegg.conf parsed in memory, re-reading it only when its
+    # mtime/size change. Property changes are grouped for idle_delay
+    # seconds, then written in one atomic replace; touchegg picks the new
+    # file up itself, so it is only (re)started when it isn't running.
+    # on_error(message) is called (from the timer thread) when a write fails.
+    # A touchegg started here logs to log_path.
+    def __init__(self, path, idle_delay=0.5, on_error=None, log_path=None):
+        self.path = path
+        self.log_path = log_path or os.path.join(os.environ.get('XDG_RUNTIME_DIR') or '/tmp',
+                                                 "popos_multitouch_tuner", "touchegg.log")
+        self.idle_delay = idle_delay
+        self.on_error = on_error
+        self.tree = None
+        self.stamp = None
+        self.pending = {}
+        self.timer = None
+        self.lock = threading.Lock()
+        # Seconds gestures were unavailable at the last start, None if not measured
+        self.downtime = None
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _load(self):
+        stamp = self._stat()
+        if stamp is not None and stamp == self.stamp:
+            return self.tree
+        self.stamp = stamp
+        self.tree = None
+        if stamp is None:
+            return None
+        try:
+            self.tree = ET.parse(self.path)
+        except ET.ParseError:
+            print("XML Parse Error detected. Attempting to repair touchegg conf...")
+            with open(self.path, 'r') as f:
+                content = f.read()
+            # Common breakage: an escaped closing tag
+            content = content.replace('</touch&#233;gg>', '</touchégg>')
+            try:
+                self.tree = ET.ElementTree(ET.fromstring(content))
+            except ET.ParseError:
+                print("Could not repair touchegg conf, backing it up and starting a minimal one.")
+                shutil.copy(self.path, self.path + '.bak')
+                root = ET.Element('touchégg')
+                ET.SubElement(root, 'settings')
+                self.tree = ET.ElementTree(root)
+        return self.tree
+
+    def _settings(self, create=False):
+        tree = self._load()
+        if tree is None:
+            return None
+        settings = tree.getroot().find('settings')
+        if settings is None and create:
+            settings = ET.SubElement(tree.getroot(), 'settings')
+        return settings
+
+    def get(self, name, default=None):
+        with self.lock:
+            settings = self._settings()
+            if settings is not None:
+                for prop in settings.findall('property'):
+                    if prop.get('name') == name and prop.text:
+                        return prop.text
+        return default
+
+    def update(self, **props):
+        with self.lock:
+            self.pending.update({k: str(v) for k, v in props.items()})
+            if self.timer:
+                self.timer.cancel()
+            self.timer = threading.Timer(self.idle_delay, self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush(self):
+        with self.lock:
+            if self.timer:
+                self.timer.cancel()
+                self.timer = None
+            pending, self.pending = self.pending, {}
+            if not pending:
+                return False
+            settings = self._settings(create=True)
+            if settings is None:
+                print("Touchegg config file not found!")
+                return False
+            existing = {prop.get('name'): prop for prop in settings.findall('property')}
+            changed = False
+            for name, value in pending.items():
+                prop = existing.get(name)
+                if prop is None:
+                    prop = ET.SubElement(settings, 'property', name=name)
+                elif prop.text == value:
+                    continue
+                prop.text = value
+                changed = True
+            if not changed:
+                return False
+
+            tmp_path = self.path + '.tmp'
+            try:
+                with open(tmp_path, 'wb') as f:
+                    self.tree.write(f, encoding='UTF-8', xml_declaration=True)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                # Keep the changes for the next flush (newer values win) and
+                # re-read the file then, the tree already holds them
+                self.pending = dict(pending, **self.pending)
+                self.stamp = None
+                error = e
+            else:
+                self.stamp = self._stat()
+                error = None
+        if error:
+            message = f"Could not write {self.path}: {error}"
+            print(message)
+            if self.on_error:
+                self.on_error(message)
+            return False
+        print(f"Touchegg config written: {', '.join(f'{k}={v}' for k, v in pending.items())}")
+        try:
+            self.downtime = self.ensure_running()
+        except OSError as e:
+            print(f"Could not start touchegg: {e}")
+        return True
+
+    def client_running(self):
+        # The per-user touchegg client, not the system-wide "touchegg --daemon"
+        # service, which runs as root on Pop!_OS
+        result = subprocess.run(['pgrep', '-u', str(os.getuid()), '-x', 'touchegg'],
+                                stdout=subprocess.PIPE, text=True)
+        for pid in result.stdout.split():
+            try:
+                with open(f"/proc/{pid}/cmdline", 'rb') as f:
+                    args = f.read().split(b'\0')
+            except OSError:
+                continue
+            if b'--daemon' not in args:
+                return True
+        return False
+
+    def ensure_running(self, timeout=3.0):
+        # Returns how long gestures were unavailable while touchegg started.
+        # A running touchegg reloads the file in place on its own; that
+        # can't be observed from here, so it isn't measured (None).
+        if self.client_running():
+            return None
+        os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+        start = time.perf_counter()
+        # touchegg logs every gesture and must outlive the tuner, so its
+        # output goes to a file (tailed here for the connection line) and it
+        # gets its own session
+        with open(self.log_path, 'wb') as log:
+            process = subprocess.Popen(['touchegg'], stdin=subprocess.DEVNULL, stdout=log,
+                                       stderr=subprocess.STDOUT, start_new_session=True)
+        connected = False
+        seen = b''
+        deadline = start + timeout
+        with open(self.log_path, 'rb') as log:
+            while time.perf_counter() < deadline and process.poll() is None:
+                seen += log.read()
+                if b'connected to touch' in seen.lower():
+                    connected = True
+                    break
+                time.sleep(0.01)
+        downtime = time.perf_counter() - start
+        if process.poll() is not None:
+            print(f"touchegg exited with code {process.returncode}, see {self.log_path}")
+            return None
+        if not connected:
+            print(f"Touchegg started but not connected to its daemon after {timeout:.0f} s.")
+            return None
+        print(f"Touchegg started, connected after {downtime * 1000:.0f} ms.")
+        return downtime
+
 class TouchpadTuner:
     def __init__(self, root):
         self.root = root
         # Title will be set in update_ui_text
-        self.root.geometry("500x750") # Increased height
+        self.root.geometry("500x1100") # Increased height
         
         # Handle window close to minimize to tray
         self.root.protocol('WM_DELETE_WINDOW', self.minimize_to_tray)
         
+        # Input devices come from sysfs once and are kept current by hotplug events
+        self.registry = gesture_daemon.DeviceRegistry()
+        self.registry.scan()
         self.device_id = self.get_touchpad_id()
         if not self.device_id:
             messagebox.showerror("Error", "Touchpad device not found!")
@@ -85,25 +625,79 @@ class TouchpadTuner:
         self.config_dir = os.path.expanduser("~/.config/popos_multitouch_tuner")
         self.config_path = os.path.join(self.config_dir, "config.json")
         self.touchegg_conf_path = os.path.expanduser("~/.config/touchegg/touchegg.conf")
+        self.touchegg = TouchEggConfig(
+            self.touchegg_conf_path,
+            on_error=lambda message: self.call_soon(0, messagebox.showerror, "Error", message))
         self.autostart_path = os.path.expanduser("~/.config/autostart/popos_multitouch_tuner.desktop")
+        self.history_path = gesture_daemon.default_history_path()
+        self.daemon_socket_path = os.path.join(os.environ.get('XDG_RUNTIME_DIR') or '/tmp',
+                                               "popos_multitouch_tuner", "daemon.sock")
         
+        # System calls run on workers; slider bursts are coalesced before
+        # they reach gsettings/xinput/daemon
+        self.tasks = TaskRunner(self.root)
+        self.scheduler = ApplyScheduler(self.root, monitor=self.tasks)
+
         # Load config or defaults
         self.load_config()
+        # What is on the device right now, so focus changes only write differences
+        self.applied = {}
+        self.prop_writer = None
+        self.daemon_process = None
+        self.daemon_monitor = None
+        self.daemon_exit_code = None
+        self.daemon_updates = {}
+        # Lines for the log pane: the daemon process's output, or in-process
+        # (where the engine prints to our own stdout/stderr) this process's
+        self.log_ring = None
+        self.log_seq = 0
+        if self.daemon_mode == 'thread':
+            self.log_ring = LogRing(on_output=lambda ring: self.call_soon(100, self.refresh_log))
+            sys.stdout = OutputTee(sys.stdout, self.log_ring, 'out')
+            sys.stderr = OutputTee(sys.stderr, self.log_ring, 'err')
+        # Set on exit: late daemon callbacks must not start a new one
+        self.closing = False
+        # The writer's X connection is shared between workers
+        self.prop_lock = threading.Lock()
         
-        # Get current system state for speed (gsettings persists) and touchegg (file persists)
-        self.current_speed = self.get_gsettings_speed()
+        # Speed starts from the saved value; gsettings (which persists) is
+        # read on a worker and corrects the slider if it differs.
+        # Touchegg settings come from the file.
+        self.current_speed = float(self.config.get('speed') or 0.0)
         self.current_threshold, self.current_delay = self.get_touchegg_settings()
         # Scroll distance is not persistent in system usually, so we rely on config or default
         # But we can try to read it if we want to sync with current state on first run?
         # Let's just use the config value or default 15 (standard libinput default)
 
         self.create_widgets()
+        # Output from before the log pane existed
+        self.refresh_log()
+        initial_speed = self.current_speed
+        self.tasks.submit('speed', self.get_gsettings_speed,
+                          on_done=lambda speed: self.on_speed_read(speed, initial_speed))
         
         # Create persistent tray icon
         self.create_tray_icon()
+
+        # Listener runs on the monitor thread, hand over to Tk
+        self.registry.subscribe(lambda action, device: self.root.after(0, self.on_device_change, action, device))
+        try:
+            self.registry.start_monitor()
+        except OSError as e:
+            print(f"Hotplug monitoring unavailable: {e}")
+
+        # Per-application settings follow _NET_ACTIVE_WINDOW changes
+        if self.app_profiles:
+            try:
+                gesture_daemon.FocusWatcher(
+                    lambda wm_class: self.root.after(0, self.on_focus_change, wm_class)).start()
+            except Exception as e:
+                print(f"Focus tracking unavailable: {e}")
         
-        # Apply loaded settings to system (in case of reboot)
-        self.apply_stored_settings()
+        # Apply loaded settings to system (in case of reboot), unless the
+        # autostart entry already did it headlessly via gesture_daemon.py --apply
+        if "--skip-apply" not in sys.argv:
+            self.apply_stored_settings()
         
         # Check if started minimized
         if "--minimized" in sys.argv:
@@ -116,54 +710,57 @@ class TouchpadTuner:
 
     def load_config(self):
         # Defaults
-        self.current_profile = 'adaptive'
-        self.current_normal_ctm = 1.0
-        self.current_gesture_ctm = 0.4
-        self.daemon_enabled = True
-        self.current_language = 'en'
-        self.current_scroll_dist = 15 # Default libinput value
+        self.config = ConfigStore(self.config_path, {
+            'profile': 'adaptive',
+            'normal_ctm': 1.0,
+            'gesture_ctm': 0.4,
+            'daemon_enabled': True,
+            'language': 'en',
+            'scroll_dist': 15, # Default libinput value
+            # WM_CLASS -> overrides, e.g. {"firefox": {"normal_ctm": 0.8, "scroll_dist": 30}}
+            'app_profiles': {},
+            'custom_curve': dict(gesture_daemon.DEFAULT_CURVE),
+            # 'thread' runs the gesture engine inside the tuner, 'process' as gesture_daemon.py
+            'daemon_mode': 'thread'
+        })
         
-        if os.path.exists(self.config_path):
-            try:
-                with open(self.config_path, 'r') as f:
-                    config = json.load(f)
-                    self.current_profile = config.get('profile', 'adaptive')
-                    self.current_normal_ctm = config.get('normal_ctm', 1.0)
-                    self.current_gesture_ctm = config.get('gesture_ctm', 0.4)
-                    self.daemon_enabled = config.get('daemon_enabled', True)
-                    self.current_language = config.get('language', 'en')
-                    self.current_scroll_dist = config.get('scroll_dist', 15)
-                print("Config loaded.")
-            except Exception as e:
-                print(f"Error loading config: {e}")
+        try:
+            self.config.load()
+            print(f"Config loaded ({self.config.load_time * 1000:.1f} ms).")
+        except Exception as e:
+            print(f"Error loading config: {e}")
+
+        self.current_profile = self.config.get('profile')
+        self.current_normal_ctm = self.config.get('normal_ctm')
+        self.current_gesture_ctm = self.config.get('gesture_ctm')
+        self.daemon_enabled = self.config.get('daemon_enabled')
+        self.current_language = self.config.get('language')
+        self.current_scroll_dist = self.config.get('scroll_dist')
+        self.app_profiles = self.config.get('app_profiles') or {}
+        self.current_curve = dict(gesture_daemon.DEFAULT_CURVE, **self.config.get('custom_curve'))
+        self.daemon_mode = self.config.get('daemon_mode')
     
     def save_config(self):
-        if not os.path.exists(self.config_dir):
-            os.makedirs(self.config_dir)
-        
         # Only save if widgets are initialized
         if not hasattr(self, 'profile_var') or \
+           not hasattr(self, 'speed_scale') or \
            not hasattr(self, 'ctm_scale') or \
            not hasattr(self, 'gesture_ctm_scale') or \
            not hasattr(self, 'daemon_var') or \
            not hasattr(self, 'scroll_scale'):
             return
 
-        config = {
-            'profile': self.profile_var.get(),
-            'normal_ctm': self.ctm_scale.get(),
-            'gesture_ctm': self.gesture_ctm_scale.get(),
-            'daemon_enabled': self.daemon_var.get(),
-            'language': self.language_var.get(),
-            'scroll_dist': int(self.scroll_scale.get())
-        }
-        
-        try:
-            with open(self.config_path, 'w') as f:
-                json.dump(config, f, indent=4)
-            print("Config saved.")
-        except Exception as e:
-            print(f"Error saving config: {e}")
+        # Written to disk by the store once the sliders settle
+        self.config.update(
+            profile=self.profile_var.get(),
+            speed=self.speed_scale.get(),
+            normal_ctm=self.ctm_scale.get(),
+            gesture_ctm=self.gesture_ctm_scale.get(),
+            daemon_enabled=self.daemon_var.get(),
+            language=self.language_var.get(),
+            scroll_dist=int(self.scroll_scale.get()),
+            custom_curve=dict(self.current_curve)
+        )
 
     def apply_stored_settings(self):
         # Apply Profile
@@ -194,33 +791,82 @@ class TouchpadTuner:
         # Let's just set the value directly for now and maybe add a tooltip or label update.
         
         dist = int(float(val))
-        try:
-            subprocess.run(
-                ['xinput', 'set-prop', self.device_id, 'libinput Scrolling Pixel Distance', str(dist)],
-                check=True
-            )
-            # Update label to show value
-            if hasattr(self, 'scroll_label'):
-                self.scroll_label.config(text=f"Distance: {dist} px (Lower=Faster)")
-                
+        # Update label to show value
+        if hasattr(self, 'scroll_label'):
+            self.scroll_label.config(text=f"Distance: {dist} px (Lower=Faster)")
+
+        def done(result):
+            self.applied['scroll_dist'] = dist
             if save: self.save_config()
-        except Exception as e:
-            print(f"Error setting scroll distance: {e}")
+
+        # The daemon restores this distance after gestures with a scroll rule
+        if self.daemon_process:
+            self.update_daemon(scroll_dist=dist)
+
+        self.tasks.submit('scroll_dist', functools.partial(
+            subprocess.run,
+            ['xinput', 'set-prop', self.device_id, 'libinput Scrolling Pixel Distance', str(dist)],
+            check=True
+        ), on_done=done, on_error=lambda e: print(f"Error setting scroll distance: {e}"))
 
     def set_profile(self, save=True):
         profile = self.profile_var.get()
-        val = "1, 0" if profile == 'adaptive' else "0, 1"
-        try:
-            subprocess.run(
+        if profile == 'custom':
+            task = functools.partial(self.apply_custom_curve, dict(self.current_curve))
+        else:
+            val = "1, 0" if profile == 'adaptive' else "0, 1"
+            task = functools.partial(
+                subprocess.run,
                 ['xinput', 'set-prop', self.device_id, 'libinput Accel Profile Enabled', val.split(',')[0], val.split(',')[1]],
                 check=True
             )
+
+        def done(result):
             print(f"Set profile to {profile}")
+            self.applied['profile'] = profile
+            # The daemon restores this profile after each gesture
+            if hasattr(self, 'daemon_process') and self.daemon_process:
+                self.update_daemon(profile=profile)
             if save: self.save_config()
-        except Exception as e:
-            # messagebox.showerror("Error", f"Failed to set profile: {e}") 
-            # Suppress error on startup if device not ready, but print it
-            print(f"Failed to set profile: {e}")
+
+        # messagebox.showerror("Error", f"Failed to set profile: {e}") 
+        # Suppress error on startup if device not ready, but print it
+        self.tasks.submit('profile', task, on_done=done,
+                          on_error=lambda e: print(f"Failed to set profile: {e}"))
+
+    def write_props(self, props):
+        # Runs on a worker. One X connection for the tuner's own batched
+        # property writes, used by one batch at a time
+        with self.prop_lock:
+            if self.prop_writer is None:
+                self.prop_writer = gesture_daemon.make_writer(self.device_id)
+            return self.prop_writer.write(props)
+
+    def apply_custom_curve(self, curve):
+        # Step, points and profile in one batch
+        if not self.write_props(gesture_daemon.custom_curve_props(curve)):
+            raise RuntimeError("custom acceleration curve not accepted (needs libinput 1.23+)")
+
+    def on_curve_change(self):
+        curve = dict(self.current_curve)
+        for key, scale in self.curve_scales.items():
+            curve[key] = int(scale.get()) if key == 'points' else round(float(scale.get()), 2)
+        key = tuple(curve[k] for k in CURVE_KEYS)
+        if key == self.curve_rendered:
+            return
+        self.curve_rendered = key
+        self.curve_canvas.coords(self.curve_line, *curve_preview(key))
+        self.curve_label.config(text=f"Gain {curve['gain']:.2f}, threshold {curve['threshold']:.2f}, "
+                                     f"accel {curve['accel']:.2f}, {curve['points']} points")
+        self.current_curve = curve
+        if self.profile_var.get() == 'custom':
+            self.scheduler.submit('curve', self.set_curve, curve)
+
+    def set_curve(self, curve):
+        # Same key as the profile so a curve never lands before its profile switch
+        self.tasks.submit('profile', self.apply_custom_curve, curve,
+                          on_done=lambda result: self.save_config(),
+                          on_error=lambda e: print(f"Failed to set custom curve: {e}"))
 
     # ... (save_touchegg_settings) ...
 
@@ -228,9 +874,10 @@ class TouchpadTuner:
         multiplier = float(val)
         self.ctm_label.config(text=f"Multiplier: {multiplier:.2f}")
         self.current_normal_ctm = multiplier
+        self.applied['normal_ctm'] = multiplier
         
         if hasattr(self, 'daemon_process') and self.daemon_process:
-            self.restart_daemon()
+            self.update_daemon(normal=multiplier)
         else:
             self.apply_ctm_direct(multiplier)
             
@@ -246,114 +893,55 @@ class TouchpadTuner:
         self.save_config()
 
     def start_daemon(self):
+        if self.closing:
+            return
         self.stop_daemon() # Ensure clean start
         
-        normal = self.ctm_scale.get()
+        # The daemon writes its normal CTM on start; keep the focused app's
+        # override if one is applied
+        normal = self.applied.get('normal_ctm', self.ctm_scale.get())
         gesture = self.gesture_ctm_scale.get()
+        self.daemon_updates = {}
+
+        if self.daemon_mode == 'thread':
+            # In-process: no interpreter start-up, updates are plain calls
+            print("Starting gesture engine in-process")
+            self.daemon_process = gesture_daemon.GestureEngine(
+                self.device_id, normal, gesture, history_file=self.history_path,
+                on_exit=lambda engine, code: self.call_soon(0, self.on_daemon_exit, engine, code)
+            ).start()
+            self.daemon_exit_code = None
+            self.status_label.config(text=self.get_text('daemon_running'), foreground="green")
+            return
         
         cmd = [
-            'python3', '-u', '/home/hirameki/dev/antigravity_project/touchpad/gesture_daemon.py',
+            sys.executable, '-u', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gesture_daemon.py'),
             '--device', self.device_id,
             '--normal', str(normal),
-            '--gesture', str(gesture)
+            '--gesture', str(gesture),
+            '--control-socket', self.daemon_socket_path,
+            '--supervise'
         ]
         
         print(f"Starting daemon: {' '.join(cmd)}")
         try:
             self.daemon_process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            self.status_label.config(text="Daemon Status: Running", foreground="green")
+            # Output is drained into the log pane; exit is reported right away
+            self.daemon_monitor = DaemonMonitor(
+                self.daemon_process,
+                on_output=lambda monitor: self.call_soon(100, self.refresh_log),
+                on_exit=lambda monitor, code: self.call_soon(0, self.on_daemon_exit, monitor.process, code)
+            ).start()
+            self.log_ring = self.daemon_monitor
+            self.log_seq = 0
+            self.daemon_exit_code = None
+            self.status_label.config(text=self.get_text('daemon_running'), foreground="green")
         except Exception as e:
             messagebox.showerror("Error", f"Failed to start daemon: {e}")
             self.daemon_var.set(False)
 
     # ... (stop_daemon, restart_daemon) ...
 
-    def create_widgets(self):
-        # Language Selection
-        frame_lang = ttk.Frame(self.root)
-        frame_lang.pack(pady=5, padx=10, fill="x")
-        
-        self.lbl_lang = ttk.Label(frame_lang, text="Language")
-        self.lbl_lang.pack(side="left", padx=5)
-        
-        self.language_var = tk.StringVar(value=self.current_language)
-        lang_combo = ttk.Combobox(frame_lang, textvariable=self.language_var, values=['en', 'ja', 'ko'], state="readonly", width=5)
-        lang_combo.pack(side="left")
-        lang_combo.bind("<<ComboboxSelected>>", self.update_ui_text)
-
-        # Speed Control
-        self.frame_speed = ttk.LabelFrame(self.root, text="")
-        self.frame_speed.pack(pady=5, padx=10, fill="x")
-
-        self.speed_label = ttk.Label(self.frame_speed, text=f"Speed: {self.current_speed:.2f}")
-        self.speed_label.pack()
-
-        self.speed_scale = ttk.Scale(
-            self.frame_speed, from_=-1.0, to=1.0, orient='horizontal',
-            command=self.set_speed
-        )
-        self.speed_scale.set(self.current_speed)
-        self.speed_scale.pack(fill="x", padx=10, pady=2)
-
-        # Profile Control
-        self.frame_profile = ttk.LabelFrame(self.root, text="")
-        self.frame_profile.pack(pady=5, padx=10, fill="x")
-
-        self.profile_var = tk.StringVar(value=self.current_profile)
-        
-        rb_adaptive = ttk.Radiobutton(
-            self.frame_profile, text="Adaptive", 
-            variable=self.profile_var, value='adaptive', command=self.set_profile
-        )
-        rb_adaptive.pack(anchor='w', padx=10)
-
-        rb_flat = ttk.Radiobutton(
-            self.frame_profile, text="Flat", 
-            variable=self.profile_var, value='flat', command=self.set_profile
-        )
-        rb_flat.pack(anchor='w', padx=10)
-
-        # Scroll Speed Control (New)
-        self.frame_scroll = ttk.LabelFrame(self.root, text="")
-        self.frame_scroll.pack(pady=5, padx=10, fill="x")
-        
-        self.scroll_label = ttk.Label(self.frame_scroll, text=f"Distance: {self.current_scroll_dist} px")
-        self.scroll_label.pack()
-        
-        # Range 10 (Fast) to 80 (Slow). Default 15.
-        self.scroll_scale = ttk.Scale(
-            self.frame_scroll, from_=10, to=80, orient='horizontal',
-            command=self.set_scroll_dist
-        )
-        self.scroll_scale.set(self.current_scroll_dist)
-        self.scroll_scale.pack(fill="x", padx=10, pady=2)
-
-        # CTM Control (Global Sensitivity)
-        self.frame_ctm = ttk.LabelFrame(self.root, text="")
-        self.frame_ctm.pack(pady=5, padx=10, fill="x")
-        
-        self.ctm_label = ttk.Label(self.frame_ctm, text="Multiplier: 1.00")
-        self.ctm_label.pack()
-        
-        self.ctm_scale = ttk.Scale(
-            self.frame_ctm, from_=0.1, to=3.0, orient='horizontal',
-            command=self.set_ctm
-        )
-        self.ctm_scale.set(self.current_normal_ctm)
-        self.ctm_scale.pack(fill="x", padx=10, pady=2)
-
-        # Daemon
-        # ...
-        self.daemon_var = tk.BooleanVar(value=self.daemon_enabled) # Use loaded value
-        # ...
-        self.gesture_ctm_scale.set(self.current_gesture_ctm) # Use loaded value
-        # ...
-        
-    def on_gesture_scale_change(self, val):
-        if hasattr(self, 'status_label'):
-            self.restart_daemon()
-            self.save_config()
-
     def create_tray_icon(self):
         # Try to load icon from file
         icon_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "icon.png")
@@ -396,9 +984,16 @@ class TouchpadTuner:
         self.root.after(0, self.perform_exit)
 
     def perform_exit(self):
+        self.closing = True
         if hasattr(self, 'icon'):
             self.icon.stop()
+        self.scheduler.flush()
         self.stop_daemon()
+        self.tasks.close()
+        self.config.flush()
+        self.touchegg.flush()
+        if self.prop_writer:
+            self.prop_writer.close()
         self.root.quit()
         self.root.destroy()
 
@@ -414,10 +1009,13 @@ class TouchpadTuner:
             
         # Get absolute path of current script
         script_path = os.path.abspath(__file__)
+        daemon_path = os.path.join(os.path.dirname(script_path), "gesture_daemon.py")
         
+        # Settings are applied headlessly first, before Tk/tray are even imported;
+        # if that fails (e.g. the touchpad isn't enumerated yet) the tuner applies them
         content = f"""[Desktop Entry]
 Type=Application
-Exec=python3 {script_path} --minimized
+Exec=sh -c "python3 {daemon_path} --apply && exec python3 {script_path} --minimized --skip-apply || exec python3 {script_path} --minimized"
 Hidden=false
 NoDisplay=false
 X-GNOME-Autostart-enabled=true
@@ -441,6 +1039,12 @@ Comment=Touchpad sensitivity and gesture tuner
                 print(f"Failed to remove autostart entry: {e}")
 
     def get_touchpad_id(self):
+        touchpad = self.registry.touchpad()
+        if touchpad:
+            xid = self.registry.xid_for(touchpad)
+            if xid:
+                return xid
+        # Fall back to scraping xinput list (e.g. sysfs not readable)
         try:
             output = subprocess.check_output(['xinput', 'list'], text=True)
             for line in output.splitlines():
@@ -452,6 +1056,91 @@ Comment=Touchpad sensitivity and gesture tuner
             print(f"Error finding touchpad: {e}")
         return None
 
+    def on_device_change(self, action, device):
+        if not device.is_touchpad:
+            return
+        if action == 'remove':
+            print(f"Touchpad removed: {device.name} ({device.node})")
+            return
+        # X picks the device up shortly after the kernel announces it
+        self.root.after(1000, self.on_touchpad_added, device, 5)
+
+    def on_touchpad_added(self, device, attempts):
+        # xid_for may run xinput, so look it up on a worker
+        self.registry.invalidate_xids()
+        self.tasks.submit('device', self.registry.xid_for, device,
+                          on_done=lambda xid: self.on_touchpad_xid(device, attempts, xid))
+
+    def on_touchpad_xid(self, device, attempts, xid):
+        if not xid:
+            if attempts > 1:
+                self.root.after(1000, self.on_touchpad_added, device, attempts - 1)
+            else:
+                print(f"Touchpad {device.name} did not appear in X")
+            return
+        print(f"Touchpad {device.name} ({device.node}) is X device {xid}")
+        self.device_id = xid
+        with self.prop_lock:
+            if self.prop_writer:
+                self.prop_writer.close()
+                self.prop_writer = None
+        self.apply_stored_settings()
+        if self.daemon_var.get():
+            self.start_daemon()
+
+    def on_focus_change(self, wm_class):
+        target = {
+            'normal_ctm': self.current_normal_ctm,
+            'profile': self.profile_var.get(),
+            'scroll_dist': int(self.scroll_scale.get()),
+        }
+        target.update(self.app_profiles.get(wm_class, {}))
+        changed = {k: v for k, v in target.items() if self.applied.get(k) != v}
+        if not changed:
+            return
+        print(f"Focused {wm_class}: {changed}")
+        self.applied.update(changed)
+
+        # With the daemon running it owns CTM and profile (a gesture may be
+        # in progress), so those go through its control socket
+        daemon_running = hasattr(self, 'daemon_process') and self.daemon_process
+        # Each property goes through the same task key as its setter, so
+        # writes to it stay in order; every task carries the property's
+        # full value, so a newer one may replace a waiting one
+        writes = {}
+        if 'normal_ctm' in changed and not daemon_running:
+            writes['ctm'] = ('normal_ctm', [(gesture_daemon.CTM_PROP,
+                                             gesture_daemon.ctm_values(float(changed['normal_ctm'])))])
+        if 'profile' in changed and not daemon_running:
+            if changed['profile'] == 'custom':
+                props = gesture_daemon.custom_curve_props(self.current_curve)
+            else:
+                props = [(gesture_daemon.PROFILE_PROP, gesture_daemon.profile_values(changed['profile']))]
+            writes['profile'] = ('profile', props)
+        if 'scroll_dist' in changed:
+            writes['scroll_dist'] = ('scroll_dist', [(gesture_daemon.SCROLL_PROP, [int(changed['scroll_dist'])])])
+        for key, (setting, props) in writes.items():
+            self.tasks.submit(key, self.write_props, props,
+                              on_done=functools.partial(self.on_focus_written, wm_class, setting),
+                              on_error=functools.partial(self.on_focus_written, wm_class, setting, False))
+        if daemon_running:
+            update = {}
+            if 'normal_ctm' in changed:
+                update['normal'] = float(changed['normal_ctm'])
+            if 'profile' in changed:
+                update['profile'] = changed['profile']
+            if 'scroll_dist' in changed:
+                update['scroll_dist'] = int(changed['scroll_dist'])
+            if update:
+                self.update_daemon(**update)
+
+    def on_focus_written(self, wm_class, setting, ok, error=None):
+        if ok:
+            return
+        print(f"Error applying {setting} for {wm_class}: {error or 'write failed'}")
+        # Unknown device state: write it again on the next focus change
+        self.applied.pop(setting, None)
+
     def get_gsettings_speed(self):
         try:
             output = subprocess.check_output(
@@ -460,7 +1149,7 @@ Comment=Touchpad sensitivity and gesture tuner
             ).strip()
             return float(output)
         except:
-            return 0.0
+            return None
 
     def get_xinput_profile(self):
         try:
@@ -480,164 +1169,155 @@ Comment=Touchpad sensitivity and gesture tuner
         return 'adaptive'
 
     def get_touchegg_settings(self):
-        # Default values
-        threshold = 20
-        delay = 150
-        
-        if not os.path.exists(self.touchegg_conf_path):
-            return threshold, delay
-
+        # Parsed once and cached until the file changes on disk
         try:
-            tree = ET.parse(self.touchegg_conf_path)
-            root = tree.getroot()
-            settings = root.find('settings')
-            if settings is not None:
-                for prop in settings.findall('property'):
-                    name = prop.get('name')
-                    if name == 'action_execute_threshold':
-                        threshold = int(prop.text)
-                    elif name == 'animation_delay':
-                        delay = int(prop.text)
-        except ET.ParseError:
-            print("XML Parse Error detected. Attempting to read raw file...")
-            # Fallback: Read file manually if XML is broken
-            try:
-                with open(self.touchegg_conf_path, 'r') as f:
-                    content = f.read()
-                    # Simple regex to find values
-                    t_match = re.search(r'<property name="action_execute_threshold">(\d+)</property>', content)
-                    if t_match:
-                        threshold = int(t_match.group(1))
-                    d_match = re.search(r'<property name="animation_delay">(\d+)</property>', content)
-                    if d_match:
-                        delay = int(d_match.group(1))
-            except Exception as e:
-                print(f"Error reading raw file: {e}")
+            threshold = int(self.touchegg.get('action_execute_threshold', 20))
+            delay = int(self.touchegg.get('animation_delay', 150))
         except Exception as e:
             print(f"Error reading touchegg conf: {e}")
-        
+            threshold, delay = 20, 150
         return threshold, delay
 
+    def on_speed_read(self, speed, initial):
+        # Ignore the reading if the slider was moved in the meantime
+        if speed is None or speed == self.current_speed or self.current_speed != initial:
+            return
+        self.current_speed = speed
+        self.speed_label.config(text=f"Speed: {speed:.2f}")
+        # Fires set_speed, which sees the value is already current
+        self.speed_scale.set(speed)
+
     def set_speed(self, val):
         speed = float(val)
-        try:
-            subprocess.run(
-                ['gsettings', 'set', 'org.gnome.desktop.peripherals.touchpad', 'speed', str(speed)],
-                check=True
-            )
-            self.speed_label.config(text=f"Speed: {speed:.2f}")
-        except Exception as e:
-            print(f"Error setting speed: {e}")
+        self.speed_label.config(text=f"Speed: {speed:.2f}")
+        if speed == self.current_speed:
+            return
+        self.current_speed = speed
+        self.tasks.submit('speed', functools.partial(
+            subprocess.run,
+            ['gsettings', 'set', 'org.gnome.desktop.peripherals.touchpad', 'speed', str(speed)],
+            check=True
+        ), on_done=lambda result: self.save_config(),
+           on_error=lambda e: print(f"Error setting speed: {e}"))
 
     def save_touchegg_settings(self):
         threshold = int(self.threshold_scale.get())
         delay = int(self.delay_scale.get())
-        
-        print(f"Saving settings: Threshold={threshold}, Delay={delay}")
 
-        try:
-            if not os.path.exists(self.touchegg_conf_path):
-                messagebox.showerror("Error", "Touchegg config file not found!")
-                return
+        print(f"Saving settings: Threshold={threshold}, Delay={delay}")
 
-            # Read existing content first to preserve other settings
-            try:
-                tree = ET.parse(self.touchegg_conf_path)
-                root = tree.getroot()
-            except ET.ParseError:
-                print("Broken XML detected. Re-creating minimal valid config with existing content preservation is complex.")
-                print("Backing up broken config and creating new one with current settings.")
-                
-                # Backup
-                subprocess.run(['cp', self.touchegg_conf_path, self.touchegg_conf_path + '.bak'])
-                
-                # Create new minimal valid XML
-                root = ET.Element('touchégg')
-                settings = ET.SubElement(root, 'settings')
-                
-                # We might lose other app-specific gestures if we just overwrite.
-                # Let's try to fix the file content string instead.
-                with open(self.touchegg_conf_path, 'r') as f:
-                    content = f.read()
-                
-                # Fix common issues
-                # 1. Fix closing tag
-                content = content.replace('</touch&#233;gg>', '</touchégg>')
-                # 2. Remove duplicate lines if any (simple approach)
-                
-                # Write fixed content to temp file and parse
-                with open(self.touchegg_conf_path + '.fixed', 'w') as f:
-                    f.write(content)
-                
-                try:
-                    tree = ET.parse(self.touchegg_conf_path + '.fixed')
-                    root = tree.getroot()
-                except:
-                    # If still broken, use the new root
-                    tree = ET.ElementTree(root)
-
-            settings = root.find('settings')
-            if settings is None:
-                settings = ET.SubElement(root, 'settings')
-            
-            # Update or create properties
-            props = {
-                'action_execute_threshold': str(threshold),
-                'animation_delay': str(delay)
-            }
-            
-            for key, val in props.items():
-                found = False
-                for prop in settings.findall('property'):
-                    if prop.get('name') == key:
-                        prop.text = val
-                        found = True
-                        break
-                if not found:
-                    new_prop = ET.SubElement(settings, 'property', name=key)
-                    new_prop.text = val
-            
-            # Write with explicit encoding
-            tree.write(self.touchegg_conf_path, encoding='UTF-8', xml_declaration=True)
-            print("Config file written successfully.")
-
-            # Restart touchegg
-            print("Restarting touchegg...")
-            subprocess.run(['killall', 'touchegg'], stderr=subprocess.DEVNULL)
-            import time
-            time.sleep(0.5) 
-            subprocess.Popen(['touchegg'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-            print("Touchegg restarted.")
-            
-            messagebox.showinfo("Success", "Gesture settings saved and Touchegg restarted!")
-            
-        except Exception as e:
-            print(f"Exception in save_touchegg_settings: {e}")
-            messagebox.showerror("Error", f"Failed to save touchegg settings: {e}")
+        # Grouped with any other change in the next half second and
+        # written off the Tk thread
+        self.touchegg.update(action_execute_threshold=threshold, animation_delay=delay)
 
     def apply_ctm_direct(self, multiplier):
-        try:
-            subprocess.run(
-                ['xinput', 'set-prop', self.device_id, 'Coordinate Transformation Matrix', 
-                 str(multiplier), '0', '0', '0', str(multiplier), '0', '0', '0', '1'],
-                check=True
-            )
-        except Exception as e:
-            print(f"Error setting CTM: {e}")
+        self.tasks.submit('ctm', functools.partial(
+            subprocess.run,
+            ['xinput', 'set-prop', self.device_id, 'Coordinate Transformation Matrix', 
+             str(multiplier), '0', '0', '0', str(multiplier), '0', '0', '0', '1'],
+            check=True
+        ), on_error=lambda e: print(f"Error setting CTM: {e}"))
 
     def stop_daemon(self):
         if hasattr(self, 'daemon_process') and self.daemon_process:
             print("Stopping daemon...")
-            self.daemon_process.terminate()
+            if isinstance(self.daemon_process, gesture_daemon.GestureEngine):
+                # Joined on a worker; the engine restores the properties itself
+                engine = self.daemon_process
+                self.tasks.submit(f"stop {id(engine)}", engine.stop)
+            else:
+                self.daemon_process.terminate()
             self.daemon_process = None
-            self.status_label.config(text="Daemon Status: Stopped", foreground="red")
+            self.status_label.config(text=self.get_text('daemon_stopped'), foreground="red")
             # Restore normal CTM
             self.apply_ctm_direct(self.ctm_scale.get())
 
+    def on_daemon_exit(self, daemon, code):
+        self.refresh_log()
+        # Stopped or restarted on purpose
+        if daemon is not self.daemon_process:
+            return
+        print(f"Daemon exited with code {code}")
+        self.daemon_process = None
+        self.daemon_exit_code = code
+        self.status_label.config(text=self.get_text('daemon_exited').format(code), foreground="red")
+        # It may have died mid-gesture with the gesture CTM applied
+        self.apply_ctm_direct(self.ctm_scale.get())
+
+    def call_soon(self, ms, func, *args):
+        # For other threads; Tk may already be gone on exit
+        try:
+            self.root.after(ms, func, *args)
+        except (RuntimeError, tk.TclError):
+            pass
+
+    def refresh_log(self):
+        ring = self.log_ring
+        if ring is None or not hasattr(self, 'log_text'):
+            return
+        entries = ring.since(self.log_seq)
+        if not entries:
+            return
+        self.log_seq = entries[-1][0]
+        self.log_text.config(state='normal')
+        for seq, stream, line in entries:
+            self.log_text.insert('end', line + "\n", stream)
+        # Same bound as the ring: drop the oldest lines
+        excess = int(self.log_text.index('end-1c').split('.')[0]) - 1 - LOG_LINES
+        if excess > 0:
+            self.log_text.delete('1.0', f"{excess + 1}.0")
+        self.log_text.see('end')
+        self.log_text.config(state='disabled')
+
     def restart_daemon(self):
-        if self.daemon_var.get():
+        if self.daemon_var.get() and not self.closing:
             self.start_daemon()
 
+    def send_daemon(self, daemon, params):
+        # Runs on a worker
+        if isinstance(daemon, gesture_daemon.GestureEngine):
+            return daemon.update(**params)
+        # The socket only appears ~100 ms after the process starts, so keep
+        # trying while the process is alive
+        delay = 0.02
+        deadline = time.monotonic() + 3.0
+        while True:
+            try:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                    sock.settimeout(0.5)
+                    sock.connect(self.daemon_socket_path)
+                    sock.sendall((json.dumps(params) + "\n").encode())
+                    return json.loads(sock.makefile().readline())
+            except (FileNotFoundError, ConnectionRefusedError):
+                if daemon.poll() is not None or time.monotonic() + delay > deadline:
+                    raise
+                time.sleep(delay)
+                delay = min(delay * 2, 0.25)
+
+    def update_daemon(self, **params):
+        # Push new settings into the running daemon. Updates since it started
+        # are merged, so the one queued message carries the latest value of
+        # each. It is only restarted if it has actually exited.
+        daemon = self.daemon_process
+        self.daemon_updates.update(params)
+
+        def done(reply):
+            if not reply.get('ok'):
+                print(f"Daemon rejected update: {reply.get('error')}")
+
+        def failed(e):
+            print(f"Could not reach daemon: {e}")
+            if isinstance(daemon, gesture_daemon.GestureEngine):
+                exited = not daemon.running
+            else:
+                exited = daemon.poll() is not None
+            # Not stopped or replaced by us in the meantime
+            if exited and daemon is self.daemon_process:
+                self.restart_daemon()
+
+        self.tasks.submit('daemon', self.send_daemon, daemon, dict(self.daemon_updates),
+                          on_done=done, on_error=failed)
+
     def get_text(self, key):
         lang = self.language_var.get() if hasattr(self, 'language_var') else self.current_language
         return TRANSLATIONS.get(lang, TRANSLATIONS['en']).get(key, key)
@@ -654,10 +1334,15 @@ Comment=Touchpad sensitivity and gesture tuner
         self.chk_autostart.config(text=self.get_text('autostart'))
         self.lbl_info.config(text=self.get_text('note'))
         self.lbl_lang.config(text=self.get_text('language'))
+        self.frame_history.config(text=self.get_text('history_frame'))
+        self.frame_log.config(text=self.get_text('log_frame'))
+        self.refresh_history(reschedule=False)
         
         # Update status label text based on current state
         if self.daemon_process:
             self.status_label.config(text=self.get_text('daemon_running'))
+        elif self.daemon_exit_code is not None:
+            self.status_label.config(text=self.get_text('daemon_exited').format(self.daemon_exit_code))
         else:
             self.status_label.config(text=self.get_text('daemon_stopped'))
             
@@ -687,7 +1372,7 @@ Comment=Touchpad sensitivity and gesture tuner
 
         self.speed_scale = ttk.Scale(
             self.frame_speed, from_=-1.0, to=1.0, orient='horizontal',
-            command=self.set_speed
+            command=lambda v: self.scheduler.submit('speed', self.set_speed, v)
         )
         self.speed_scale.set(self.current_speed)
         self.speed_scale.pack(fill="x", padx=10, pady=2)
@@ -710,6 +1395,34 @@ Comment=Touchpad sensitivity and gesture tuner
         )
         rb_flat.pack(anchor='w', padx=10)
 
+        rb_custom = ttk.Radiobutton(
+            self.frame_profile, text="Custom",
+            variable=self.profile_var, value='custom', command=self.set_profile
+        )
+        rb_custom.pack(anchor='w', padx=10)
+
+        # Custom curve: a few parameters generate the libinput motion points
+        frame_curve = ttk.Frame(self.frame_profile)
+        frame_curve.pack(fill="x", padx=10, pady=2)
+        width, height = CURVE_PREVIEW_SIZE
+        self.curve_canvas = tk.Canvas(frame_curve, width=width, height=height, background="white")
+        self.curve_canvas.pack(side="right", padx=5)
+        # Flat response for reference; the curve line is moved, never recreated
+        self.curve_canvas.create_line(*curve_preview((1.0, 0.0, 0.0, 2, 10.0)), fill="gray", dash=(2, 2))
+        self.curve_line = self.curve_canvas.create_line(0, height, width, 0, fill="blue", width=2)
+        self.curve_rendered = None
+        self.curve_label = ttk.Label(frame_curve, text="", font=("Arial", 8))
+        self.curve_scales = {}
+        for key, low, high in (('gain', 0.2, 3.0), ('threshold', 0.0, 8.0), ('accel', 0.0, 5.0),
+                               ('points', 2, gesture_daemon.CUSTOM_POINTS_MAX)):
+            scale = ttk.Scale(frame_curve, from_=low, to=high, orient='horizontal',
+                              command=lambda v: self.on_curve_change())
+            scale.set(self.current_curve[key])
+            scale.pack(fill="x")
+            self.curve_scales[key] = scale
+        self.curve_label.pack(anchor='w')
+        self.on_curve_change()
+
         # Scroll Speed Control (New)
         self.frame_scroll = ttk.LabelFrame(self.root, text="")
         self.frame_scroll.pack(pady=5, padx=10, fill="x")
@@ -720,7 +1433,7 @@ Comment=Touchpad sensitivity and gesture tuner
         # Range 10 (Fast) to 80 (Slow). Default 15.
         self.scroll_scale = ttk.Scale(
             self.frame_scroll, from_=10, to=80, orient='horizontal',
-            command=self.set_scroll_dist
+            command=lambda v: self.scheduler.submit('scroll_dist', self.set_scroll_dist, v)
         )
         self.scroll_scale.set(self.current_scroll_dist)
         self.scroll_scale.pack(fill="x", padx=10, pady=2)
@@ -734,7 +1447,7 @@ Comment=Touchpad sensitivity and gesture tuner
         
         self.ctm_scale = ttk.Scale(
             self.frame_ctm, from_=0.1, to=3.0, orient='horizontal',
-            command=self.set_ctm
+            command=lambda v: self.scheduler.submit('ctm', self.set_ctm, v)
         )
         self.ctm_scale.set(self.current_normal_ctm)
         self.ctm_scale.pack(fill="x", padx=10, pady=2)
@@ -757,7 +1470,7 @@ Comment=Touchpad sensitivity and gesture tuner
         
         # Use a wrapper for command to check if initialization is done
         self.gesture_ctm_scale = ttk.Scale(self.frame_daemon, from_=0.1, to=2.0, orient='horizontal', 
-                                           command=lambda v: self.on_gesture_scale_change(v))
+                                           command=lambda v: self.scheduler.submit('gesture_ctm', self.on_gesture_scale_change, v))
         self.gesture_ctm_scale.set(self.current_gesture_ctm)
         self.gesture_ctm_scale.pack(fill="x", padx=10, pady=2)
         
@@ -767,17 +1480,50 @@ Comment=Touchpad sensitivity and gesture tuner
                                         variable=self.autostart_var, command=self.toggle_autostart)
         self.chk_autostart.pack(anchor='w', padx=10, pady=5)
 
+        # Gesture history, read from the daemon's hourly rollups
+        self.frame_history = ttk.LabelFrame(self.root, text="")
+        self.frame_history.pack(pady=5, padx=10, fill="x")
+        self.history_label = ttk.Label(self.frame_history, text="", justify="left")
+        self.history_label.pack(anchor='w', padx=10, pady=2)
+
+        # Last LOG_LINES lines of daemon output
+        self.frame_log = ttk.LabelFrame(self.root, text="")
+        self.frame_log.pack(pady=5, padx=10, fill="both", expand=True)
+        log_scroll = ttk.Scrollbar(self.frame_log, orient='vertical')
+        log_scroll.pack(side='right', fill='y')
+        self.log_text = tk.Text(self.frame_log, height=8, wrap='none', state='disabled',
+                                font=("Monospace", 8), yscrollcommand=log_scroll.set)
+        self.log_text.tag_configure('err', foreground="red")
+        self.log_text.pack(fill="both", expand=True, padx=5, pady=2)
+        log_scroll.config(command=self.log_text.yview)
+
         # Info
         self.lbl_info = ttk.Label(self.root, text="", font=("Arial", 8), foreground="gray")
         self.lbl_info.pack(side="bottom", pady=2)
         
         # Initial text update
         self.update_ui_text()
+        self.root.after(60000, self.refresh_history)
+
+    def refresh_history(self, reschedule=True):
+        # The daemon flushes once a minute; only the aggregated rows are read
+        try:
+            rows = gesture_daemon.read_history(self.history_path)
+        except Exception as e:
+            print(f"Error reading gesture history: {e}")
+            rows = []
+        lines = [f"{fingers}-finger {kind}: {count} ({count / 24:.1f}/h), "
+                 f"typical {mean_ms:.0f} ms, longest {max_ms:.0f} ms"
+                 for kind, fingers, count, mean_ms, max_ms in rows[:5]]
+        self.history_label.config(text="\n".join(lines) or self.get_text('history_empty'))
+        if reschedule:
+            self.root.after(60000, self.refresh_history)
 
     def on_gesture_scale_change(self, val):
-        # Only restart if fully initialized
-        if hasattr(self, 'status_label'):
-            self.restart_daemon()
+        # Only update if fully initialized and the daemon is running
+        if hasattr(self, 'status_label') and getattr(self, 'daemon_process', None):
+            self.update_daemon(gesture=float(val))
+        self.save_config()
 
 if __name__ == "__main__":
     root = tk.Tk()
@@ -0,0 +1,35 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from gesture_daemon import handle_control, GestureParams, ShadowWriter, FakeWriter, CTM_PROP, ctm_values
+
+
+def make():
+    return GestureParams(1.0, 0.4, 'adaptive'), ShadowWriter(FakeWriter())
+
+
+@pytest.mark.parametrize('message', [
+    {'normal': 1.5, 'gesture': 'fast'},
+    {'normal': 1.5, 'profile': 'weird'},
+    {'gesture': 0.3, 'scroll_dist': None},
+])
+def test_invalid_field_rejects_whole_message(message):
+    params, writer = make()
+    with pytest.raises((TypeError, ValueError)):
+        handle_control(message, writer, params)
+    assert (params.normal_ctm, params.gesture_ctm, params.initial_profile, params.initial_scroll) == \
+        (1.0, 0.4, 'adaptive', None)
+    assert writer.writes == 0
+
+
+def test_valid_message_is_applied_and_written():
+    params, writer = make()
+    reply = handle_control({'normal': '1.5', 'gesture': 0.3, 'profile': 'flat', 'scroll_dist': 20},
+                           writer, params)
+    assert reply['ok'] and reply['normal'] == 1.5 and reply['gesture'] == 0.3
+    assert (params.initial_profile, params.initial_scroll) == ('flat', 20)
+    assert writer.shadow[CTM_PROP] == ctm_values(1.5)
@@ -0,0 +1,103 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from gesture_daemon import DeviceRegistry, ABS_MT_POSITION_X, BTN_TOOL_FINGER, INPUT_PROP_POINTER, BUS_VIRTUAL
+
+
+def make_device(sysfs_root, event_name, name, touchpad=True, bustype=0x18):
+    # Just the sysfs files DeviceRegistry reads
+    base = sysfs_root / event_name / 'device'
+    (base / 'capabilities').mkdir(parents=True)
+    (base / 'id').mkdir()
+    (base / 'name').write_text(name + '\n')
+    abs_caps = 1 << ABS_MT_POSITION_X if touchpad else 0
+    key_caps = 1 << BTN_TOOL_FINGER if touchpad else 0
+    (base / 'capabilities' / 'abs').write_text(f"{abs_caps:x}\n")
+    (base / 'capabilities' / 'key').write_text(f"{key_caps:x}\n")
+    (base / 'properties').write_text(f"{1 << INPUT_PROP_POINTER:x}\n")
+    (base / 'id' / 'bustype').write_text(f"{bustype:04x}\n")
+
+
+def uevent(action, event_name, subsystem='input'):
+    # Kernel format: "action@devpath\0KEY=value\0..."
+    devpath = f"/devices/platform/i8042/serio1/input/input9/{event_name}"
+    fields = [f"{action}@{devpath}", f"ACTION={action}", f"DEVPATH={devpath}",
+              f"SUBSYSTEM={subsystem}", f"DEVNAME=input/{event_name}", "SEQNUM=4242"]
+    return '\0'.join(fields).encode() + b'\0'
+
+
+def make_registry(tmp_path):
+    registry = DeviceRegistry(str(tmp_path))
+    seen = []
+    registry.subscribe(lambda action, device: seen.append((action, device.node)))
+    return registry, seen
+
+
+def test_add_uevent_registers_device_and_notifies(tmp_path):
+    registry, seen = make_registry(tmp_path)
+    registry.xids = {'SynPS/2 Synaptics TouchPad': '12'}
+    make_device(tmp_path, 'event13', 'SynPS/2 Synaptics TouchPad')
+
+    action, device = registry.handle_uevent(uevent('add', 'event13'))
+
+    assert action == 'add'
+    assert device.node == '/dev/input/event13'
+    assert device.is_touchpad
+    assert registry.devices['/dev/input/event13'] is device
+    assert seen == [('add', '/dev/input/event13')]
+    # A hotplug may renumber X devices
+    assert registry.xids is None
+
+
+def test_remove_uevent_drops_device_and_notifies(tmp_path):
+    registry, seen = make_registry(tmp_path)
+    make_device(tmp_path, 'event13', 'SynPS/2 Synaptics TouchPad')
+    registry.scan()
+
+    action, device = registry.handle_uevent(uevent('remove', 'event13'))
+
+    assert action == 'remove'
+    assert device.name == 'SynPS/2 Synaptics TouchPad'
+    assert registry.devices == {}
+    assert seen == [('remove', '/dev/input/event13')]
+
+
+def test_irrelevant_uevents_are_ignored(tmp_path):
+    registry, seen = make_registry(tmp_path)
+    make_device(tmp_path, 'event13', 'SynPS/2 Synaptics TouchPad')
+    registry.scan()
+
+    assert registry.handle_uevent(uevent('add', 'event13', subsystem='usb')) is None
+    assert registry.handle_uevent(uevent('change', 'event13')) is None
+    # Unknown device, or gone from sysfs before we could read it
+    assert registry.handle_uevent(uevent('remove', 'event99')) is None
+    assert registry.handle_uevent(uevent('add', 'event99')) is None
+    assert list(registry.devices) == ['/dev/input/event13']
+    assert seen == []
+
+
+def test_listener_errors_do_not_stop_other_listeners(tmp_path, capsys):
+    registry, seen = make_registry(tmp_path)
+    registry.listeners.insert(0, lambda action, device: 1 / 0)
+    make_device(tmp_path, 'event13', 'SynPS/2 Synaptics TouchPad')
+
+    registry.handle_uevent(uevent('add', 'event13'))
+
+    assert seen == [('add', '/dev/input/event13')]
+    assert 'Error in device listener' in capsys.readouterr().err
+
+
+def test_touchpad_skips_other_and_virtual_devices(tmp_path):
+    registry, seen = make_registry(tmp_path)
+    make_device(tmp_path, 'event10', 'SynPS/2 Synaptics TouchPad (scaled)', bustype=BUS_VIRTUAL)
+    make_device(tmp_path, 'event3', 'AT Translated Set 2 keyboard', touchpad=False, bustype=0x11)
+    registry.scan()
+    assert registry.touchpad() is None
+
+    make_device(tmp_path, 'event13', 'SynPS/2 Synaptics TouchPad')
+    registry.handle_uevent(uevent('add', 'event13'))
+
+    assert registry.touchpad().node == '/dev/input/event13'
+    assert not registry.devices['/dev/input/event10'].is_touchpad
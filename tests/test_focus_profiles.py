@@ -0,0 +1,166 @@
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+# The tuner module pulls in the GUI stack at import time
+pytest.importorskip('tkinter')
+pytest.importorskip('PIL')
+pytest.importorskip('pystray')
+
+import gesture_daemon
+from popos_multitouch_tuner import TouchpadTuner, TaskRunner
+from gesture_daemon import CTM_PROP, PROFILE_PROP, SCROLL_PROP, ctm_values, profile_values
+
+
+class FakeRoot:
+    # Collects root.after callbacks from the workers; pump() runs them on
+    # the test thread, like Tk's event loop would
+    def __init__(self):
+        self.queue = []
+        self.cond = threading.Condition()
+
+    def after(self, ms, func, *args):
+        with self.cond:
+            self.queue.append((func, args))
+            self.cond.notify()
+
+    def pump(self, tasks):
+        while tasks.running or tasks.waiting:
+            with self.cond:
+                assert self.cond.wait_for(lambda: self.queue, 5)
+                func, args = self.queue.pop(0)
+            func(*args)
+
+
+class Var:
+    def __init__(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+
+class Device:
+    # What write_props has put on the touchpad; a write can be held or failed
+    def __init__(self):
+        self.props = {}
+        self.release = threading.Event()
+        self.release.set()
+        self.fail = set()
+
+    def write(self, props):
+        self.release.wait(5)
+        if any(prop in self.fail for prop, _values in props):
+            return False
+        for prop, values in props:
+            self.props[prop] = values
+        return True
+
+
+BASE = {'normal_ctm': 1.0, 'profile': 'adaptive', 'scroll_dist': 15}
+GIMP = {'normal_ctm': 0.5, 'profile': 'flat'}
+
+
+def make_tuner():
+    # Only the state on_focus_change and start_daemon use, no window
+    tuner = TouchpadTuner.__new__(TouchpadTuner)
+    tuner.root = FakeRoot()
+    tuner.tasks = TaskRunner(tuner.root)
+    tuner.device = Device()
+    tuner.write_props = tuner.device.write
+    tuner.current_normal_ctm = BASE['normal_ctm']
+    tuner.ctm_scale = Var(BASE['normal_ctm'])
+    tuner.gesture_ctm_scale = Var(0.4)
+    tuner.profile_var = Var(BASE['profile'])
+    tuner.scroll_scale = Var(BASE['scroll_dist'])
+    tuner.current_curve = dict(gesture_daemon.DEFAULT_CURVE)
+    tuner.app_profiles = {'Gimp': GIMP}
+    tuner.applied = dict(BASE)
+    tuner.daemon_process = None
+    tuner.closing = False
+    return tuner
+
+
+def focus(tuner, wm_class):
+    tuner.on_focus_change(wm_class)
+    tuner.root.pump(tuner.tasks)
+
+
+def test_override_is_applied_and_restored():
+    tuner = make_tuner()
+
+    focus(tuner, 'Gimp')
+    assert tuner.device.props == {CTM_PROP: ctm_values(0.5), PROFILE_PROP: profile_values('flat')}
+    assert tuner.applied == dict(BASE, **GIMP)
+
+    focus(tuner, 'firefox')
+    assert tuner.device.props == {CTM_PROP: ctm_values(1.0), PROFILE_PROP: profile_values('adaptive')}
+    assert tuner.applied == BASE
+
+    # Nothing differs, nothing is written
+    tuner.device.props = {}
+    focus(tuner, 'firefox')
+    assert tuner.device.props == {}
+
+
+def test_replaced_write_leaves_last_focus_applied():
+    tuner = make_tuner()
+    tuner.app_profiles['Inkscape'] = {'normal_ctm': 0.7, 'scroll_dist': 40}
+    # Gimp's writes hold the workers, Inkscape's wait and are then replaced
+    # by the restore for firefox
+    tuner.device.release.clear()
+    tuner.on_focus_change('Gimp')
+    tuner.on_focus_change('Inkscape')
+    tuner.on_focus_change('firefox')
+    assert tuner.tasks.stats['replaced'] == 1
+    tuner.device.release.set()
+    tuner.root.pump(tuner.tasks)
+
+    # Inkscape's scroll distance was queued on its own key and restored after it
+    assert tuner.device.props == {CTM_PROP: ctm_values(1.0), PROFILE_PROP: profile_values('adaptive'),
+                                  SCROLL_PROP: [15]}
+    assert tuner.applied == BASE
+
+
+def test_failed_write_is_retried_on_next_focus_change():
+    tuner = make_tuner()
+    tuner.device.fail.add(PROFILE_PROP)
+
+    focus(tuner, 'Gimp')
+    assert tuner.device.props == {CTM_PROP: ctm_values(0.5)}
+    assert 'profile' not in tuner.applied
+
+    tuner.device.fail.clear()
+    focus(tuner, 'firefox')
+    # The profile's state was unknown, so it is written again
+    assert tuner.device.props[PROFILE_PROP] == profile_values('adaptive')
+    assert tuner.applied == BASE
+
+
+def test_daemon_restart_keeps_focused_override(monkeypatch):
+    tuner = make_tuner()
+    focus(tuner, 'Gimp')
+
+    started = []
+
+    class Engine:
+        def __init__(self, device_id, normal, gesture, **kwargs):
+            started.append((normal, gesture))
+
+        def start(self):
+            return self
+
+    monkeypatch.setattr(gesture_daemon, 'GestureEngine', Engine)
+    tuner.device_id = '12'
+    tuner.daemon_mode = 'thread'
+    tuner.history_path = ''
+    tuner.stop_daemon = lambda: None
+    tuner.status_label = type('Label', (), {'config': lambda self, **kwargs: None})()
+    tuner.get_text = lambda key: key
+    tuner.start_daemon()
+
+    assert started == [(0.5, 0.4)]
@@ -0,0 +1,47 @@
+import io
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+# The tuner module pulls in the GUI stack at import time
+pytest.importorskip('tkinter')
+pytest.importorskip('PIL')
+pytest.importorskip('pystray')
+
+from popos_multitouch_tuner import LogRing, OutputTee
+
+
+def test_tee_passes_output_through_and_keeps_whole_lines():
+    notified = []
+    ring = LogRing(on_output=notified.append, lines=3)
+    out = io.StringIO()
+    tee = OutputTee(out, ring, 'err')
+
+    print("Error in loop: boom", file=tee)
+    print("partial", end='', file=tee)
+    assert [text for _seq, _stream, text in ring.since(0)] == ["Error in loop: boom"]
+    print(" line", file=tee)
+
+    # Engine threads print through the same stream
+    worker = threading.Thread(target=lambda: print("from engine thread", file=tee))
+    worker.start()
+    worker.join()
+
+    assert out.getvalue() == "Error in loop: boom\npartial line\nfrom engine thread\n"
+    assert ring.since(0) == [(1, 'err', "Error in loop: boom"), (2, 'err', "partial line"),
+                             (3, 'err', "from engine thread")]
+    # Notified once, then again only after since() picked the lines up
+    assert notified == [ring, ring]
+
+
+def test_ring_keeps_only_the_last_lines():
+    ring = LogRing(on_output=lambda ring: None, lines=3)
+    tee = OutputTee(io.StringIO(), ring, 'out')
+    for i in range(5):
+        print(f"line {i}", file=tee)
+    assert [text for _seq, _stream, text in ring.since(0)] == ["line 2", "line 3", "line 4"]
+    assert ring.since(4) == [(5, 'out', "line 4")]
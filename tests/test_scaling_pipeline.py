@@ -0,0 +1,93 @@
+import os
+import struct
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from gesture_daemon import (ScalingPipeline, FileSink, GestureParams, GestureRules, EVENT_FORMAT, EV_SYN, EV_ABS,
+                            SYN_REPORT, ABS_MT_SLOT, ABS_MT_TRACKING_ID, ABS_MT_POSITION_X, ABS_MT_POSITION_Y)
+
+
+def frame(*events):
+    return b''.join(struct.pack(EVENT_FORMAT, 0, 0, *event) for event in events + ((EV_SYN, SYN_REPORT, 0),))
+
+
+def touch(fingers):
+    # Each finger lands in its own slot, 100 units apart
+    events = []
+    for slot in range(fingers):
+        events += [(EV_ABS, ABS_MT_SLOT, slot), (EV_ABS, ABS_MT_TRACKING_ID, 100 + slot),
+                   (EV_ABS, ABS_MT_POSITION_X, 1000 + slot * 100), (EV_ABS, ABS_MT_POSITION_Y, 2000)]
+    return frame(*events)
+
+
+def move(fingers, dx, dy, step):
+    events = []
+    for slot in range(fingers):
+        events += [(EV_ABS, ABS_MT_SLOT, slot),
+                   (EV_ABS, ABS_MT_POSITION_X, 1000 + slot * 100 + dx * step),
+                   (EV_ABS, ABS_MT_POSITION_Y, 2000 + dy * step)]
+    return frame(*events)
+
+
+def emitted_positions(path):
+    # slot -> [(x, y) after each frame that moved it]
+    with open(path, 'rb') as f:
+        data = f.read()
+    positions = {}
+    current = {}
+    slot = 0
+    for _sec, _usec, ev_type, code, value in struct.iter_unpack(EVENT_FORMAT, data):
+        if ev_type == EV_ABS and code == ABS_MT_SLOT:
+            slot = value
+        elif ev_type == EV_ABS and code in (ABS_MT_POSITION_X, ABS_MT_POSITION_Y):
+            current.setdefault(slot, [None, None])[code - ABS_MT_POSITION_X] = value
+        elif ev_type == EV_SYN and code == SYN_REPORT:
+            for moved, xy in current.items():
+                positions.setdefault(moved, []).append(tuple(xy))
+            current = {}
+    return positions
+
+
+def run(tmp_path, fingers, steps=3):
+    path = str(tmp_path / 'out.evdev')
+    sink = FileSink(path)
+    pipeline = ScalingPipeline(GestureParams(1.0, 0.5, 'adaptive'), sink)
+    found = pipeline.feed(touch(fingers))
+    for step in range(1, steps + 1):
+        found += pipeline.feed(move(fingers, 40, -20, step))
+    sink.close()
+    return emitted_positions(path), found
+
+
+def deltas(track):
+    return [(b[0] - a[0], b[1] - a[1]) for a, b in zip(track, track[1:])]
+
+
+def test_one_and_two_fingers_pass_through(tmp_path):
+    for fingers in (1, 2):
+        positions, found = run(tmp_path, fingers)
+        assert found == []
+        for slot in range(fingers):
+            assert positions[slot][0] == (1000 + slot * 100, 2000)
+            assert deltas(positions[slot]) == [(40, -20)] * 3
+
+
+def test_three_fingers_are_scaled_by_gesture_multiplier(tmp_path):
+    positions, found = run(tmp_path, 3)
+    assert [event[:3] for event in found] == [('begin', 3, 'swipe')]
+    for slot in range(3):
+        # Contacts start where they really are, then move at half speed
+        assert positions[slot][0] == (1000 + slot * 100, 2000)
+        assert deltas(positions[slot]) == [(20, -10)] * 3
+
+
+def test_rule_multiplier_overrides_gesture_slider(tmp_path):
+    path = str(tmp_path / 'out.evdev')
+    sink = FileSink(path)
+    rules = GestureRules([{'type': 'swipe', 'fingers': 4, 'ctm': 0.25}, {'type': 'swipe', 'fingers': 3}])
+    pipeline = ScalingPipeline(GestureParams(1.0, 0.5, 'adaptive', rules), sink)
+    pipeline.feed(touch(4))
+    pipeline.feed(move(4, 40, -20, 1))
+    sink.close()
+    assert deltas(emitted_positions(path)[0]) == [(10, -5)]
@@ -0,0 +1,85 @@
+import os
+import shlex
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import gesture_daemon
+from gesture_daemon import GestureEngine, FakeWriter, STATS, CTM_PROP, ctm_values, profile_values, PROFILE_PROP
+
+
+class RecordingWriter(FakeWriter):
+    # Keeps every batch, with when it was written
+    batches = []
+
+    def write(self, props):
+        RecordingWriter.batches.append((time.monotonic(), props))
+        return super().write(props)
+
+
+def source_cmd(lifetime):
+    # A stand-in for libinput debug-events: starts a 3-finger swipe and
+    # dies in the middle of it
+    script = (r"printf ' event13  GESTURE_SWIPE_BEGIN     +0.000s\t3\n'; "
+              f"exec sleep {lifetime}")
+    return shlex.join(['sh', '-c', script])
+
+
+def supervise(monkeypatch, tmp_path, lifetime, sessions, min_backoff, max_backoff):
+    RecordingWriter.batches = []
+    monkeypatch.setitem(gesture_daemon.WRITERS, 'fake', RecordingWriter)
+    ready = []
+    enough = threading.Event()
+
+    def on_ready(engine):
+        ready.append(time.monotonic())
+        if len(ready) >= sessions:
+            enough.set()
+
+    node = tmp_path / 'event13'
+    node.touch()
+    engine = GestureEngine(None, normal=1.0, gesture=0.4, backend='fake', input_mode='libinput',
+                           rules_path=str(tmp_path / 'missing.json'), event_node=str(node),
+                           source_cmd=source_cmd(lifetime), min_backoff=min_backoff,
+                           max_backoff=max_backoff, on_ready=on_ready)
+    restarts = STATS.counters['restarts']
+    engine.start()
+    try:
+        assert enough.wait(10)
+    finally:
+        assert engine.stop()
+    return ready, STATS.counters['restarts'] - restarts
+
+
+def test_reconnect_restores_normal_props(monkeypatch, tmp_path):
+    ready, restarts = supervise(monkeypatch, tmp_path, 0.05, 3, 0.01, 1.0)
+    assert restarts >= 2
+
+    normal = [(CTM_PROP, ctm_values(1.0)), (PROFILE_PROP, profile_values('adaptive'))]
+    gesture = ctm_values(0.4)
+    for started, next_started in zip(ready, ready[1:]):
+        session = [props for stamp, props in RecordingWriter.batches if started < stamp < next_started]
+        switched = [i for i, props in enumerate(session) if (CTM_PROP, gesture) in props]
+        assert switched
+        # The stream died mid-gesture: normal CTM and profile come back as
+        # soon as it's lost, and are written again once the device is back
+        # since its state can't be trusted after a reset
+        restores = [props for props in session[switched[-1] + 1:] if props == normal]
+        assert len(restores) == 2
+
+
+def test_backoff_grows_while_source_keeps_failing(monkeypatch, tmp_path):
+    ready, _ = supervise(monkeypatch, tmp_path, 0, 5, 0.02, 0.16)
+    first, last = ready[1] - ready[0], ready[-1] - ready[-2]
+    # 0.02, 0.04, 0.08, 0.16
+    assert last > 0.1
+    assert last > first * 2
+
+
+def test_backoff_resets_after_a_long_session(monkeypatch, tmp_path):
+    # Sessions outlive max_backoff, so every reconnect starts from min_backoff
+    ready, _ = supervise(monkeypatch, tmp_path, 0.25, 5, 0.02, 0.16)
+    longest = max(b - a for a, b in zip(ready, ready[1:]))
+    assert longest < 0.25 + 0.1